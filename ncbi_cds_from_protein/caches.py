@@ -39,9 +39,12 @@
 
 from __future__ import annotations
 
+import atexit
 import logging
 import sqlite3
-from collections import defaultdict
+import zlib
+from itertools import groupby
+from operator import itemgetter
 
 # SQL QUERIES
 # ===========
@@ -69,18 +72,32 @@ from collections import defaultdict
 # needed when input sequences are NCBI (UniProt GNs can be used to query
 # for nucleotide sequences directly.
 #
-# The nt_uid_acc table has a *:* relationship with seqdata. Each input
+# Nucleotide sequences have a *:* relationship with seqdata. Each input
 # sequence may correspond to more than one nucleotide database entry at NCBI.
 # We need to identify the corresponding UID and accession for each one. Both
 # UID and accession are required, as we will be downloading GenBank entries
 # in batch form, and these contain the accession but not the UID in their
 # headers.
-# The *:* relationship is mediated by the seq_nt table, which references
-# the seqdata accession (unique to input sequence) and the nt_uid_acc
-# accession (unique to NCBI nucleotide sequence).
+# The seq_nt_link table holds one row for each (input sequence accession,
+# nt UID) pair, with the GenBank accession for the UID (nt_accession), which
+# is NULL until it is known. This saves joining a separate UID/accession
+# table to get from an input sequence to its GenBank records. The primary
+# key covers lookups by input sequence; uid and nt_accession are indexed
+# for lookups by nucleotide sequence.
+#
+# Queries for rows missing from another table are written as
+# LEFT JOIN ... WHERE <other table key> IS NULL, rather than NOT IN (SELECT ...),
+# so that SQLite can probe the other table's primary key index for each row.
+#
+# Multi-statement DDL scripts (SQL_CREATEDB, SQL_CREATE_INDICES) are run with
+# _run_ddl(), which uses executescript(). executescript() COMMITs any pending
+# transaction before it starts, and runs each statement outside a transaction,
+# so it must never be used for DML: inserts and updates are made with
+# execute()/executemany() inside a "with conn:" block, so that each batch is
+# written atomically in a single transaction.
 
 
-# Create tables
+# Create tables (DDL only: see _run_ddl())
 SQL_CREATEDB = """
     DROP TABLE IF EXISTS seqdata;
     CREATE TABLE seqdata (accession TEXT PRIMARY KEY NOT NULL,
@@ -89,31 +106,69 @@ SQL_CREATEDB = """
                          );
     DROP TABLE IF EXISTS elink;
     DROP TABLE IF EXISTS seq_nt;
-    CREATE TABLE seq_nt (seq_nt_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                         accession TEXT NOT NULL,
-                         uid TEXT NOT NULL,
-                         FOREIGN KEY(accession) REFERENCES seqdata(accession),
-                         FOREIGN KEY(uid) REFERENCES nt_uid_acc(uid)
-                        );
     DROP TABLE IF EXISTS nt_uid_acc;
-    CREATE TABLE nt_uid_acc (uid TEXT PRIMARY KEY NOT NULL,
-                             accession TEXT
-                            );
+    DROP TABLE IF EXISTS seq_nt_link;
+    CREATE TABLE seq_nt_link (prot_accession TEXT NOT NULL,
+                              uid TEXT NOT NULL,
+                              nt_accession TEXT,
+                              PRIMARY KEY (prot_accession, uid),
+                              FOREIGN KEY(prot_accession) REFERENCES seqdata(accession)
+                             );
     DROP TABLE IF EXISTS gb_headers;
     CREATE TABLE gb_headers (accession TEXT PRIMARY KEY NOT NULL,
                              length INTEGER NOT NULL,
                              organism TEXT NOT NULL,
                              taxonomy TEXT NOT NULL,
-                             date TEXT NOT NULL,
-                             FOREIGN KEY (accession) REFERENCES nt_uid_acc(accession)
+                             date TEXT NOT NULL
                             );
     DROP TABLE IF EXISTS gb_full;
     CREATE TABLE gb_full (accession TEXT PRIMARY KEY NOT NULL,
-                          record TEXT NOT NULL,
-                          FOREIGN KEY (accession) REFERENCES nt_uid_acc(accession)
+                          record BLOB NOT NULL
                          );
 """
 
+# Version of the cache schema, stored as the database's user_version. Caches
+# made by older versions of ncfp have user_version 0, and are brought up to
+# date when opened (see CacheDB.upgrade()):
+# 1 - seq_nt and nt_uid_acc merged into seq_nt_link; gb_full records stored
+#     zlib-compressed
+CACHE_SCHEMA_VERSION = 1
+
+# Full GenBank records are mostly repetitive ASCII (indentation, qualifier
+# names, sequence), and compress several-fold. A low zlib level keeps the
+# compression cost small next to the download.
+GBFULL_COMPRESSION = 3
+
+# Move data from the seq_nt and nt_uid_acc tables of caches made by older
+# versions of ncfp into seq_nt_link (see CacheDB.upgrade()).
+SQL_MIGRATE_SEQ_NT_LINK = (
+    """CREATE TABLE seq_nt_link (prot_accession TEXT NOT NULL,
+                                 uid TEXT NOT NULL,
+                                 nt_accession TEXT,
+                                 PRIMARY KEY (prot_accession, uid),
+                                 FOREIGN KEY(prot_accession) REFERENCES seqdata(accession)
+                                );""",
+    """INSERT OR IGNORE INTO seq_nt_link (prot_accession, uid, nt_accession)
+              SELECT seq_nt.accession, seq_nt.uid, nt_uid_acc.accession
+                     FROM seq_nt JOIN nt_uid_acc ON seq_nt.uid=nt_uid_acc.uid;""",
+    "DROP TABLE seq_nt;",
+    "DROP TABLE nt_uid_acc;",
+)
+
+# Report whether a cache has the named table
+SQL_HAS_TABLE = """
+    SELECT COUNT(*) FROM sqlite_master
+           WHERE type='table' AND name=?;
+"""
+
+# Create indices on the join columns. These are also created when a
+# connection is opened, so that caches made by older versions of ncfp and
+# reused with --keepcache get them too.
+SQL_CREATE_INDICES = """
+    CREATE INDEX IF NOT EXISTS idx_seq_nt_link_uid ON seq_nt_link(uid);
+    CREATE INDEX IF NOT EXISTS idx_seq_nt_link_nt_acc ON seq_nt_link(nt_accession);
+"""
+
 # Add a new sequence to seqdata
 SQL_ADDSEQ = """
     INSERT INTO seqdata (accession, aa_query, nt_query)
@@ -131,24 +186,58 @@ SQL_ADD_GBFULL = """
     VALUES (?, ?);
 """
 
+# Get GenBank records stored uncompressed, by older versions of ncfp
+SQL_GET_TEXT_GBFULL = """
+    SELECT accession, record FROM gb_full
+           WHERE typeof(record)='text';
+"""
+
+SQL_UPDATE_GBFULL = """
+    UPDATE gb_full
+           SET record=? WHERE accession=?;
+"""
+
 SQL_GET_GBHEADER_LENGTHS = """
-    SELECT prot_id, nt_id, length FROM
-           (SELECT seq_nt.accession AS prot_id,
-                   nt_uid_acc.accession AS nt_id FROM
-                         seq_nt JOIN nt_uid_acc ON seq_nt.uid=nt_uid_acc.uid)
+    SELECT seq_nt_link.prot_accession AS prot_id,
+           seq_nt_link.nt_accession AS nt_id, length FROM
+           seq_nt_link JOIN gb_headers
+                       ON seq_nt_link.nt_accession=gb_headers.accession
+           ORDER BY prot_id, length, nt_id;
+"""
+
+# Get the shortest GenBank accession for each input sequence accession. Where
+# more than one GenBank record has the shortest length, the lowest accession
+# is taken, so that the choice is reproducible.
+SQL_GET_SHORTEST_GB = """
+    WITH lengths AS
+         (SELECT seq_nt_link.prot_accession AS prot_id,
+                 seq_nt_link.nt_accession AS nt_id, length FROM
+                 seq_nt_link JOIN gb_headers
+                             ON seq_nt_link.nt_accession=gb_headers.accession)
+    SELECT MIN(lengths.nt_id) FROM lengths
            JOIN
-           gb_headers ON nt_id=gb_headers.accession;
+           (SELECT prot_id, MIN(length) AS minlen FROM lengths
+                   GROUP BY prot_id) AS shortest
+           ON lengths.prot_id=shortest.prot_id AND lengths.length=shortest.minlen
+           GROUP BY lengths.prot_id;
 """
 
 # Get the full GenBank record corresponding to input sequence accession
 SQL_GET_GBRECORD_BY_SEQ = """
-    SELECT prot_id, nt_id, gb_full.record FROM
-           (SELECT seq_nt.accession AS prot_id,
-                   nt_uid_acc.accession AS nt_id FROM
-                         seq_nt JOIN nt_uid_acc ON seq_nt.uid=nt_uid_acc.uid)
-           JOIN
-           gb_full ON nt_id=gb_full.accession
-           WHERE prot_id=?;
+    SELECT seq_nt_link.prot_accession, seq_nt_link.nt_accession,
+           gb_full.record FROM
+           seq_nt_link JOIN gb_full ON seq_nt_link.nt_accession=gb_full.accession
+           WHERE seq_nt_link.prot_accession=?;
+"""
+
+
+# Get full GenBank records linked to sequence accessions from a list. The IN
+# clause placeholders are filled in with str.format() before use.
+SQL_GET_GBRECORDS_BY_SEQS = """
+    SELECT seq_nt_link.prot_accession, seq_nt_link.nt_accession,
+           gb_full.record FROM
+           seq_nt_link JOIN gb_full ON seq_nt_link.nt_accession=gb_full.accession
+           WHERE seq_nt_link.prot_accession IN ({});
 """
 
 
@@ -172,73 +261,284 @@ SQL_GET_SEQDATA_AAQUERY = """
 
 # Get known nt UIDs for a sequence accession
 SQL_GET_NT_UIDS = """
-    SELECT uid FROM seq_nt
-           WHERE accession=?;
+    SELECT uid FROM seq_nt_link
+           WHERE prot_accession=?;
+"""
+
+# Get those sequence accessions from a list that have at least one nt UID.
+# The IN clause placeholders are filled in with str.format() before use.
+SQL_GET_ACCS_WITH_NT_UIDS = """
+    SELECT DISTINCT prot_accession FROM seq_nt_link
+           WHERE prot_accession IN ({});
 """
 
-# Add nt UID for a sequence accession
-SQL_ADD_NT_UID = """
-    INSERT INTO nt_uid_acc (uid, accession)
-           VALUES (?, ?);
+# Get the nt and aa queries for sequence accessions from a list. The IN
+# clause placeholders are filled in with str.format() before use.
+SQL_GET_SEQDATA_QUERIES_MANY = """
+    SELECT accession, nt_query, aa_query FROM seqdata
+           WHERE accession IN ({});
 """
 
-# Add linker between seqdata and nt_uid_acc
+# Link nt UID to a sequence accession. The UID's GenBank accession is copied
+# from any other link to the same UID, or is NULL until it is known. Only
+# links already in the cache are skipped: other constraint failures (e.g. a
+# NULL UID) still raise an error.
 SQL_ADD_SEQDATA_NT_LINK = """
-    INSERT INTO seq_nt (accession, uid)
-           VALUES (?, ?);
+    INSERT INTO seq_nt_link (prot_accession, uid, nt_accession)
+           VALUES (?, ?,
+                   (SELECT nt_accession FROM seq_nt_link
+                           WHERE uid=? AND nt_accession IS NOT NULL LIMIT 1))
+           ON CONFLICT(prot_accession, uid) DO NOTHING;
+"""
+
+# Get those nt UIDs from a list that are already in the cache. The IN clause
+# placeholders are filled in with str.format() before use.
+SQL_GET_KNOWN_UIDS = """
+    SELECT DISTINCT uid FROM seq_nt_link
+           WHERE uid IN ({});
 """
 
 # Get all nt UIDs
 SQL_GET_UIDS = """
-    SELECT uid FROM nt_uid_acc;
+    SELECT DISTINCT uid FROM seq_nt_link;
 """
 
 # Get all nt UIDs with no GenBank accession
 SQL_GET_NOACC_UIDS = """
-    SELECT uid FROM nt_uid_acc
-           WHERE accession IS NULL;
+    SELECT DISTINCT uid FROM seq_nt_link
+           WHERE nt_accession IS NULL;
 """
 
 
 # Get all nt UIDs with no associated GenBank header
 SQL_GET_NOGBHEAD_UIDS = """
-    SELECT uid FROM nt_uid_acc
-           WHERE accession NOT IN
-                 (SELECT accession FROM gb_headers);
+    SELECT DISTINCT seq_nt_link.uid FROM seq_nt_link
+           LEFT JOIN gb_headers ON seq_nt_link.nt_accession=gb_headers.accession
+           WHERE seq_nt_link.nt_accession IS NOT NULL
+                 AND gb_headers.accession IS NULL;
 """
 
 # Get all nt UIDs with no associated full GenBank record
 SQL_GET_NOGBFULL_UIDS = """
-    SELECT uid FROM nt_uid_acc
-           WHERE accession NOT IN
-                 (SELECT accession FROM gb_full);
+    SELECT DISTINCT seq_nt_link.uid FROM seq_nt_link
+           LEFT JOIN gb_full ON seq_nt_link.nt_accession=gb_full.accession
+           WHERE seq_nt_link.nt_accession IS NOT NULL
+                 AND gb_full.accession IS NULL;
 """
 
 # Get all nt accessions with no associated full GenBank record
 SQL_GET_NOGBFULL_ACC = """
-    SELECT accession FROM nt_uid_acc
-           WHERE accession NOT IN
-                 (SELECT accession FROM gb_full);
+    SELECT DISTINCT seq_nt_link.nt_accession FROM seq_nt_link
+           LEFT JOIN gb_full ON seq_nt_link.nt_accession=gb_full.accession
+           WHERE seq_nt_link.nt_accession IS NOT NULL
+                 AND gb_full.accession IS NULL;
 """
 
-# Update nt_uid_acc row with accession
+# Update all links to an nt UID with its GenBank accession
 SQL_UPDATE_UID_ACC = """
-    UPDATE nt_uid_acc
-           SET accession=? WHERE uid=?;
+    UPDATE seq_nt_link
+           SET nt_accession=? WHERE uid=?;
 """
 
 
+# Maximum number of values bound in a single IN (...) query. Older SQLite
+# builds allow at most 999 bound variables per statement.
+SQL_MAX_VARIABLES = 500
+
+# Connection settings for the cache. The cache only holds data that can be
+# downloaded again, so we trade some crash-safety for write speed: WAL
+# journalling avoids rewriting a rollback journal on each commit, and with
+# synchronous=NORMAL SQLite does not fsync on every commit in WAL mode. The
+# page cache (64MiB) and memory-mapped I/O (256MiB) sizes are upper limits.
+SQL_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA mmap_size=268435456;",
+    "PRAGMA cache_size=-65536;",
+)
+
+# Run when a cache connection is closed. PRAGMA optimize runs ANALYZE only on
+# tables whose statistics are missing or stale, so that the query planner
+# makes good use of the indices as the cache grows; analysis_limit bounds the
+# number of rows ANALYZE examines in each index.
+SQL_CLOSE_PRAGMAS = (
+    "PRAGMA analysis_limit=1000;",
+    "PRAGMA optimize;",
+)
+
+# Number of prepared statements each cache connection keeps compiled. This
+# comfortably holds every SQL statement defined above, so none of them should
+# need to be re-parsed by SQLite once they have been used once.
+STATEMENT_CACHE_SIZE = 256
+
+
+def compress_gbfull(record: str) -> bytes:
+    """Return GenBank record text compressed for storage in gb_full."""
+    return zlib.compress(record.encode("utf-8"), GBFULL_COMPRESSION)
+
+
+def decompress_gbfull(data: bytes) -> str:
+    """Return GenBank record text from compressed gb_full data."""
+    return zlib.decompress(data).decode("utf-8")
+
+
+def _run_ddl(conn, script) -> None:
+    """Run a script of schema (DDL) statements on a cache connection.
+
+    conn         - sqlite3.Connection to the cache
+    script       - SQL script containing only DDL statements
+
+    The script is run with executescript(), which commits any open
+    transaction first: do not use this for DML (see module comments).
+    """
+    conn.executescript(script)
+
+
+class CacheDB:
+    """Long-lived connection to an SQLite3 cache database.
+
+    Opening a connection for every cache query costs filesystem calls and
+    throws away SQLite's compiled statements. A single CacheDB is kept for
+    each cache path (see get_cachedb()) and its connection is reused by all
+    of the module-level functions below.
+    """
+
+    def __init__(self, path) -> None:
+        """Instantiate class.
+
+        path     - path to SQLite3 database cache
+        """
+        self.path = path
+        # Path must be string, not PosixPath, in Py3.6
+        # The connection's statement cache holds prepared statements keyed
+        # on their SQL text, so passing the same SQL constant reuses them.
+        self.conn = sqlite3.connect(
+            str(path),
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for pragma in SQL_PRAGMAS:
+            self.conn.execute(pragma)
+        self.upgrade()
+        try:
+            _run_ddl(self.conn, SQL_CREATE_INDICES)
+        except sqlite3.OperationalError:
+            pass  # new cache with no tables yet: see initialise_dbcache()
+
+    def has_table(self, name) -> bool:
+        """Return True if the cache database has the named table."""
+        return self.conn.execute(SQL_HAS_TABLE, (name,)).fetchone()[0] > 0
+
+    def upgrade(self) -> None:
+        """Bring a cache made by an older version of ncfp up to date.
+
+        All changes are made in a single transaction, so an interrupted
+        upgrade leaves the cache as it was.
+        """
+        logger = logging.getLogger(__name__)
+
+        version = self.conn.execute("PRAGMA user_version;").fetchone()[0]
+        if version >= CACHE_SCHEMA_VERSION or not self.has_table("seqdata"):
+            return  # up to date, or new cache: see initialise_dbcache()
+
+        logger.info("Updating cache %s to the current schema", self.path)
+        with self.conn:
+            self.conn.execute("BEGIN")
+            if self.has_table("seq_nt"):
+                for statement in SQL_MIGRATE_SEQ_NT_LINK:
+                    self.conn.execute(statement)
+            self.conn.executemany(
+                SQL_UPDATE_GBFULL,
+                [
+                    (compress_gbfull(record), accession)
+                    for accession, record in self.conn.execute(SQL_GET_TEXT_GBFULL)
+                ],
+            )
+            self.conn.execute(f"PRAGMA user_version = {CACHE_SCHEMA_VERSION};")
+
+    def close(self) -> None:
+        """Close the connection to the cache database.
+
+        Before closing, SQLite is asked to refresh any query planner
+        statistics that are out of date, with a bound on the work done.
+        """
+        for pragma in SQL_CLOSE_PRAGMAS:
+            self.conn.execute(pragma)
+        self.conn.close()
+
+
+# Open cache connections, keyed by cache path
+_CACHEDBS: dict[str, CacheDB] = {}
+
+
+def get_cachedb(cachepath) -> CacheDB:
+    """Return the shared CacheDB for the passed cache path.
+
+    cachepath    - path to SQLite3 database cache
+
+    The connection is opened on first use, and reused thereafter.
+    """
+    key = str(cachepath)
+    if key not in _CACHEDBS:
+        _CACHEDBS[key] = CacheDB(cachepath)
+    return _CACHEDBS[key]
+
+
+def close_cachedb(cachepath) -> None:
+    """Close the shared connection to the passed cache path, if it is open.
+
+    cachepath    - path to SQLite3 database cache
+    """
+    cachedb = _CACHEDBS.pop(str(cachepath), None)
+    if cachedb is not None:
+        cachedb.close()
+
+
+@atexit.register
+def close_all_cachedbs() -> None:
+    """Close all open shared cache connections.
+
+    Closing the last connection to a cache checkpoints its write-ahead log
+    back into the main database file, so this is registered to run at exit
+    in case a connection is left open (e.g. on an error).
+    """
+    for cachepath in list(_CACHEDBS):
+        close_cachedb(cachepath)
+
+
+def _chunks(items, size=SQL_MAX_VARIABLES):
+    """Yield successive lists of at most size items from items."""
+    items = list(items)
+    for idx in range(0, len(items), size):
+        yield items[idx : idx + size]
+
+
+def _first_column(cur) -> list:
+    """Return the first column of each row returned by the passed cursor.
+
+    The cursor is iterated directly, so rows are stepped through by SQLite one
+    at a time rather than first being collected into a list by fetchall().
+    A list is returned, rather than a generator, because callers may update
+    the queried tables while they work through the result.
+    """
+    return [row[0] for row in cur]
+
+
+def _placeholders(values) -> str:
+    """Return comma-separated SQL placeholders, one for each of values."""
+    return ",".join("?" * len(values))
+
+
 # Initialise SQLite cache
 def initialise_dbcache(path) -> None:
     """Initialise SQLite cache.
 
     path     - path to SQLite3 database cache
     """
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(path))
-    with conn:
-        cur = conn.cursor()
-        cur.executescript(SQL_CREATEDB)
+    conn = get_cachedb(path).conn
+    _run_ddl(conn, SQL_CREATEDB)
+    _run_ddl(conn, SQL_CREATE_INDICES)
+    conn.execute(f"PRAGMA user_version = {CACHE_SCHEMA_VERSION};")
 
 
 def add_input_sequence(cachepath, accession, aa_query, nt_query) -> int | None:
@@ -251,9 +551,8 @@ def add_input_sequence(cachepath, accession, aa_query, nt_query) -> int | None:
     """
     logger = logging.getLogger(__name__)
 
-    # Path must be string, not PosixPath, in Py3.6
     logger.debug("aa_query: %s nt_query: %s", aa_query, nt_query)
-    conn = sqlite3.connect(str(cachepath))
+    conn = get_cachedb(cachepath).conn
     with conn:
         cur = conn.cursor()
         cur.execute(SQL_ADDSEQ, (accession, aa_query, nt_query))
@@ -262,8 +561,7 @@ def add_input_sequence(cachepath, accession, aa_query, nt_query) -> int | None:
 
 def has_query(cachepath, accession) -> bool:
     """Return True if a seqdata row has any query."""
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(cachepath))
+    conn = get_cachedb(cachepath).conn
     with conn:
         cur = conn.cursor()
         cur.execute(SQL_GET_SEQDATA_QUERIES, (accession,))
@@ -274,8 +572,7 @@ def has_query(cachepath, accession) -> bool:
 
 def has_nt_query(cachepath, accession) -> bool:
     """Return True if a seqdata row has an nt query."""
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(cachepath))
+    conn = get_cachedb(cachepath).conn
     with conn:
         cur = conn.cursor()
         cur.execute(SQL_GET_SEQDATA_NTQUERY, (accession,))
@@ -286,8 +583,7 @@ def has_nt_query(cachepath, accession) -> bool:
 
 def has_aa_query(cachepath, accession) -> bool:
     """Return True if a seqdata row has an aa query."""
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(cachepath))
+    conn = get_cachedb(cachepath).conn
     with conn:
         cur = conn.cursor()
         cur.execute(SQL_GET_SEQDATA_AAQUERY, (accession,))
@@ -298,8 +594,7 @@ def has_aa_query(cachepath, accession) -> bool:
 
 def get_nt_query(cachepath, accession):
     """Return nt query for a seqdata row."""
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(cachepath))
+    conn = get_cachedb(cachepath).conn
     with conn:
         cur = conn.cursor()
         cur.execute(SQL_GET_SEQDATA_NTQUERY, (accession,))
@@ -308,8 +603,7 @@ def get_nt_query(cachepath, accession):
 
 def get_aa_query(cachepath, accession):
     """Return aa query for a seqdata row."""
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(cachepath))
+    conn = get_cachedb(cachepath).conn
     with conn:
         cur = conn.cursor()
         cur.execute(SQL_GET_SEQDATA_AAQUERY, (accession,))
@@ -318,8 +612,7 @@ def get_aa_query(cachepath, accession):
 
 def has_ncbi_uid(cachepath, accession) -> bool:
     """Return True if seq accession has at least one nt UID."""
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(cachepath))
+    conn = get_cachedb(cachepath).conn
     with conn:
         cur = conn.cursor()
         cur.execute(SQL_GET_NT_UIDS, (accession,))
@@ -328,143 +621,242 @@ def has_ncbi_uid(cachepath, accession) -> bool:
     return True
 
 
+def get_seqdata_queries(cachepath, accessions) -> dict[str, tuple]:
+    """Return dictionary of (nt query, aa query) keyed by seq accession.
+
+    cachepath    - path to SQLite3 database cache
+    accessions   - collection of input sequence accessions
+
+    This is a bulk equivalent of the has_*_query() and get_*_query()
+    functions. Queries missing from the cache are None, and accessions
+    not in the cache are absent from the dictionary.
+    """
+    conn = get_cachedb(cachepath).conn
+    queries = {}
+    for chunk in _chunks(set(accessions)):
+        sql = SQL_GET_SEQDATA_QUERIES_MANY.format(_placeholders(chunk))
+        for accession, nt_query, aa_query in conn.execute(sql, chunk):
+            queries[accession] = (nt_query, aa_query)
+    return queries
+
+
+def get_accessions_with_ncbi_uids(cachepath, accessions) -> set[str]:
+    """Return the set of passed seq accessions having at least one nt UID.
+
+    cachepath    - path to SQLite3 database cache
+    accessions   - collection of input sequence accessions
+
+    This is a bulk equivalent of has_ncbi_uid(), querying the cache once for
+    each chunk of accessions rather than once for each accession.
+    """
+    conn = get_cachedb(cachepath).conn
+    found = set()
+    for chunk in _chunks(set(accessions)):
+        sql = SQL_GET_ACCS_WITH_NT_UIDS.format(_placeholders(chunk))
+        found.update(_first_column(conn.execute(sql, chunk)))
+    return found
+
+
 def add_ncbi_uids(cachepath, accession, uids):
-    """Add collection of nt UIDs to cache for a record."""
+    """Add collection of nt UIDs to cache for a record.
+
+    cachepath    - path to SQLite3 database cache
+    accession    - input sequence accession the UIDs are linked to
+    uids         - collection of NCBI nucleotide UIDs
+
+    Returns the list of UIDs that were not already in the cache. All UIDs
+    are written in a single transaction.
+    """
+    return add_ncbi_uids_many(cachepath, [(accession, uids)])
+
+
+def add_ncbi_uids_many(cachepath, links):
+    """Add collections of nt UIDs to cache for several records.
+
+    cachepath    - path to SQLite3 database cache
+    links        - iterable of (accession, UIDs) tuples, giving the input
+                   sequence accession and collection of NCBI nucleotide
+                   UIDs linked to it
+
+    Returns the list of UIDs that were not already in the cache, each
+    listed once. All links are written in a single transaction.
+    """
     logger = logging.getLogger(__name__)
 
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(cachepath))
-    results = []
-    # Exclude uids that are in the database/cache
-    with conn:
-        cur = conn.cursor()
-        for uid in uids:
-            try:
-                cur.execute(SQL_ADD_NT_UID, (uid, None))
-                results.append(cur.fetchone())
-            except sqlite3.IntegrityError as err:
-                # Skip if the UID exists in the cache
-                if str(err).startswith("UNIQUE constraint failed"):
-                    pass
-                else:
-                    logger.error("Adding NCBI UID filed (exiting)", exc_info=True)
-                    raise SystemExit(1)
-            cur.execute(SQL_ADD_SEQDATA_NT_LINK, (accession, uid))
-    return results
+    conn = get_cachedb(cachepath).conn
+    rows = list(
+        dict.fromkeys(  # drop repeated links, keeping order
+            (accession, uid) for accession, uids in links for uid in uids
+        )
+    )
+    uids = list(dict.fromkeys(uid for _, uid in rows))
+
+    # Find UIDs already in the cache, so that we can report the new ones
+    new_uids = set(uids)
+    for chunk in _chunks(uids):
+        cur = conn.execute(SQL_GET_KNOWN_UIDS.format(_placeholders(chunk)), chunk)
+        new_uids.difference_update(row[0] for row in cur)
+
+    try:
+        with conn:
+            conn.executemany(
+                SQL_ADD_SEQDATA_NT_LINK,
+                [(accession, uid, uid) for accession, uid in rows],
+            )
+    except sqlite3.IntegrityError:
+        logger.error("Adding NCBI UID failed (exiting)", exc_info=True)
+        raise SystemExit(1)
+    return [uid for uid in uids if uid in new_uids]
 
 
 def get_nt_uids(cachepath):
     """Return list of nt UIDs."""
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(cachepath))
-    with conn:
-        cur = conn.cursor()
-        cur.execute(SQL_GET_UIDS)
-    return [uid[0] for uid in cur.fetchall()]
+    conn = get_cachedb(cachepath).conn
+    return _first_column(conn.execute(SQL_GET_UIDS))
 
 
 def get_nogbhead_nt_uids(cachepath):
     """Return list of nt UIDs with no cached GenBank header."""
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(cachepath))
-    with conn:
-        cur = conn.cursor()
-        cur.execute(SQL_GET_NOGBHEAD_UIDS)
-    return [uid[0] for uid in cur.fetchall()]
+    conn = get_cachedb(cachepath).conn
+    return _first_column(conn.execute(SQL_GET_NOGBHEAD_UIDS))
 
 
 def get_nt_noacc_uids(cachepath):
     """Return list of nt UIDs having no GenBank accession."""
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(cachepath))
-    with conn:
-        cur = conn.cursor()
-        cur.execute(SQL_GET_NOACC_UIDS)
-    return [uid[0] for uid in cur.fetchall()]
+    conn = get_cachedb(cachepath).conn
+    return _first_column(conn.execute(SQL_GET_NOACC_UIDS))
 
 
-def update_nt_uid_acc(cachepath, uid, accession):
-    """Update nt UID GenBank accession."""
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(cachepath))
-    results = []
+def update_nt_uid_acc(cachepath, uid, accession) -> int:
+    """Update nt UID GenBank accession.
+
+    Returns the number of cached links to the UID that were updated.
+    """
+    return update_nt_uid_acc_many(cachepath, [(uid, accession)])
+
+
+def update_nt_uid_acc_many(cachepath, rows) -> int:
+    """Update GenBank accessions for nt UIDs in a single transaction.
+
+    cachepath    - path to SQLite3 database cache
+    rows         - iterable of (UID, GenBank accession) tuples
+
+    Returns the number of cached links to the UIDs that were updated.
+    """
+    conn = get_cachedb(cachepath).conn
     with conn:
-        cur = conn.cursor()
-        cur.execute(SQL_UPDATE_UID_ACC, (accession, uid))
-        results.append(cur.fetchone())
-    return results
+        cur = conn.executemany(
+            SQL_UPDATE_UID_ACC, [(accession, uid) for uid, accession in rows]
+        )
+    return cur.rowcount
 
 
 def add_gbheaders(cachepath, accession, length, org, taxon, date):
     """Add a new GenBank header to the cache."""
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(cachepath))
-    with conn:
-        cur = conn.cursor()
-        cur.execute(SQL_ADD_GBHEADER, (accession, length, org, taxon, date))
-    return cur.fetchone()
+    return add_gbheaders_many(cachepath, [(accession, length, org, taxon, date)])
 
 
-def get_gbheader_lengths(cachepath):
-    """Return GenBank accessions and lengths for each sequence."""
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(cachepath))
+def add_gbheaders_many(cachepath, rows) -> int:
+    """Add new GenBank headers to the cache in a single transaction.
+
+    cachepath    - path to SQLite3 database cache
+    rows         - iterable of (accession, length, organism, taxonomy, date)
+                   tuples
+
+    Returns the number of headers added.
+    """
+    conn = get_cachedb(cachepath).conn
     with conn:
-        cur = conn.cursor()
-        cur.execute(SQL_GET_GBHEADER_LENGTHS)
+        cur = conn.executemany(SQL_ADD_GBHEADER, rows)
+    return cur.rowcount
+
 
-    result = defaultdict(list)
-    for seqid, gbid, gblen in cur.fetchall():
-        result[seqid].append((gblen, gbid))
+def get_gbheader_lengths(cachepath):
+    """Return GenBank lengths and accessions for each sequence.
 
-    return result
+    Returns a dictionary, keyed by input sequence accession, of lists of
+    (length, GenBank accession) tuples, shortest first. The rows are
+    sorted by the database, so each sequence's rows are grouped as they
+    are read.
+    """
+    conn = get_cachedb(cachepath).conn
+    return {
+        seqid: [(gblen, gbid) for _, gbid, gblen in rows]
+        for seqid, rows in groupby(
+            conn.execute(SQL_GET_GBHEADER_LENGTHS),
+            key=itemgetter(0),
+        )
+    }
 
 
 def find_shortest_genbank(cachepath):
     """Return shortest GenBank entries covering all sequences."""
-    shortids = set()
-    gblens = get_gbheader_lengths(cachepath)
-    for seqid in gblens:
-        shortid = sorted(gblens[seqid])[0][1]
-        shortids.add(shortid)
-    return shortids
+    conn = get_cachedb(cachepath).conn
+    return {row[0] for row in conn.execute(SQL_GET_SHORTEST_GB)}
 
 
 def add_gbfull(cachepath, accession, record):
     """Add a new full GenBank record to the cache."""
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(cachepath))
+    return add_gbfull_many(cachepath, [(accession, record)])
+
+
+def add_gbfull_many(cachepath, rows) -> int:
+    """Add new full GenBank records to the cache in a single transaction.
+
+    cachepath    - path to SQLite3 database cache
+    rows         - iterable of (accession, GenBank record text) tuples
+
+    Returns the number of records added. Records are stored compressed.
+    """
+    conn = get_cachedb(cachepath).conn
     with conn:
-        cur = conn.cursor()
-        cur.execute(SQL_ADD_GBFULL, (accession, record))
-    return cur.fetchone()
+        cur = conn.executemany(
+            SQL_ADD_GBFULL,
+            ((accession, compress_gbfull(record)) for accession, record in rows),
+        )
+    return cur.rowcount
 
 
 def get_nogbfull_nt_uids(cachepath):
     """Return list of nt UIDs with no cached full GenBank record."""
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(cachepath))
-    with conn:
-        cur = conn.cursor()
-        cur.execute(SQL_GET_NOGBFULL_UIDS)
-    return [uid[0] for uid in cur.fetchall()]
+    conn = get_cachedb(cachepath).conn
+    return _first_column(conn.execute(SQL_GET_NOGBFULL_UIDS))
 
 
 def get_nogbfull_nt_acc(cachepath):
     """Return list of nt accessions with no cached full GenBank record."""
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(cachepath))
-    with conn:
-        cur = conn.cursor()
-        cur.execute(SQL_GET_NOGBFULL_ACC)
-    return [uid[0] for uid in cur.fetchall()]
+    conn = get_cachedb(cachepath).conn
+    return _first_column(conn.execute(SQL_GET_NOGBFULL_ACC))
 
 
 def find_record_cds(cachepath, accession):
     """Return CDS sequence for passed input accession."""
-    # Path must be string, not PosixPath, in Py3.6
-    conn = sqlite3.connect(str(cachepath))
-    with conn:
-        cur = conn.cursor()
-        cur.execute(SQL_GET_GBRECORD_BY_SEQ, (accession,))
-    return cur.fetchall()
+    conn = get_cachedb(cachepath).conn
+    return [
+        (prot_id, nt_id, decompress_gbfull(record))
+        for prot_id, nt_id, record in conn.execute(
+            SQL_GET_GBRECORD_BY_SEQ,
+            (accession,),
+        )
+    ]
+
+
+def find_records_cds(cachepath, accessions) -> dict[str, list]:
+    """Return dictionary of CDS sequence results keyed by input accession.
+
+    cachepath    - path to SQLite3 database cache
+    accessions   - collection of input sequence accessions
+
+    This is a bulk equivalent of find_record_cds(). Each value is the list
+    find_record_cds() would return for that accession; accessions with no
+    linked GenBank record are absent from the dictionary.
+    """
+    conn = get_cachedb(cachepath).conn
+    results = {}
+    for chunk in _chunks(set(accessions)):
+        sql = SQL_GET_GBRECORDS_BY_SEQS.format(_placeholders(chunk))
+        for prot_id, nt_id, record in conn.execute(sql, chunk):
+            results.setdefault(prot_id, []).append(
+                (prot_id, nt_id, decompress_gbfull(record))
+            )
+    return results
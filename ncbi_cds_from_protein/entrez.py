@@ -37,25 +37,41 @@
 # THE SOFTWARE.
 """Functions to interact with Entre."""
 
+import atexit
 import logging
-from io import StringIO
-
-from Bio import Entrez, SeqIO
+import math
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException, HTTPMessage
+from io import BytesIO
+from itertools import islice
+from typing import Optional
+from urllib.error import HTTPError, URLError
+from xml.etree import ElementTree
+
+import requests
+
+from Bio import Entrez
+from Bio.Entrez.Parser import CorruptedXMLError, NotXMLError
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
+from urllib3.util.retry import Retry
 
 from ncbi_cds_from_protein.caches import (
-    add_gbfull,
-    add_gbheaders,
-    add_ncbi_uids,
+    add_gbfull_many,
+    add_gbheaders_many,
+    add_ncbi_uids_many,
     find_shortest_genbank,
+    get_accessions_with_ncbi_uids,
     get_nogbfull_nt_acc,
     get_nogbhead_nt_uids,
     get_nt_noacc_uids,
-    get_nt_query,
-    has_aa_query,
-    has_ncbi_uid,
-    has_nt_query,
-    update_nt_uid_acc,
+    get_seqdata_queries,
+    update_nt_uid_acc_many,
 )
 
 from .sequences import strip_stockholm_from_seqid
@@ -103,6 +119,439 @@ class NCFPMaxretryException(Exception):
         Exception.__init__(self, msg)
 
 
+# RATE LIMITING
+# =============
+# NCBI allows no more than three requests per second to the E-utilities, or
+# ten per second with an API key. Like Biopython, we space requests by a
+# little more than a third of a second without a key, as exactly 3/s can
+# still trip NCBI's limit. Biopython's own delay is not thread-safe, so
+# every query made from worker threads draws on a shared RateLimiter.
+ENTREZ_INTERVAL = 0.37  # seconds between requests, without an API key
+ENTREZ_INTERVAL_APIKEY = 0.1  # seconds between requests, with an API key
+
+# Number of Entrez queries that may be in flight at any one time. This is
+# larger than the permitted request rate so that the rate limit, not network
+# latency, determines throughput.
+ENTREZ_WORKERS = 10
+
+# Number of EPost/EFetch batches that may be in flight or downloaded, but
+# not yet parsed, at any one time
+EFETCH_PENDING = 2 * ENTREZ_WORKERS
+
+
+class RateLimiter:
+    """Thread-safe limiter spacing calls evenly in time."""
+
+    def __init__(self, interval: Optional[float] = None) -> None:
+        """Instantiate class.
+
+        interval  - minimum number of seconds between calls; if None, this
+                    is chosen by whether an NCBI API key is set in Entrez
+        """
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next = time.monotonic()  # earliest time of the next call
+
+    def current_interval(self) -> float:
+        """Return minimum number of seconds between calls."""
+        if self.interval is not None:
+            return self.interval
+        if Entrez.api_key:
+            return ENTREZ_INTERVAL_APIKEY
+        return ENTREZ_INTERVAL
+
+    def acquire(self) -> None:
+        """Block until a call may be made without exceeding the rate."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.current_interval()
+        if slot > now:
+            time.sleep(slot - now)
+
+    def backoff(self) -> None:
+        """Hold back the next call by at least one interval from now."""
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + self.current_interval())
+
+
+RATE_LIMITER = RateLimiter()
+
+
+# RETRIES
+# =======
+# Failed Entrez requests are retried only if the failure may be transient
+# (network errors, truncated or non-XML responses, NCBI rate limiting, server
+# errors, or errors NCBI reports inside an XML response), after an
+# exponentially increasing, jittered delay, so that a struggling NCBI is not
+# hammered with immediate retries. Other errors (e.g. HTTP 400
+# for a bad query) fail at once.
+RETRY_BASE_DELAY = 1.0  # seconds before the first retry
+RETRY_MAX_DELAY = 30.0  # longest wait between retries
+RETRY_HTTP_CODES = {429, 500, 502, 503, 504}
+
+
+def is_recoverable(exc: Exception) -> bool:
+    """Return True if a failed Entrez request is worth retrying.
+
+    exc       - exception raised by the failed request
+    """
+    if isinstance(exc, HTTPError):
+        return exc.code in RETRY_HTTP_CODES
+    # URLError and socket errors are OSErrors; IncompleteRead is an
+    # HTTPException; NCFPEFetchException, CorruptedXMLError, NotXMLError (e.g.
+    # an HTML error page) and ParseError mean we received an incomplete or
+    # unexpected response. Entrez.read() raises RuntimeError for an ERROR
+    # element in NCBI's response, such as the transient "Unable to obtain
+    # query #1"; these are retried too, as they can't be told apart from
+    # NCBI's permanent errors.
+    return isinstance(
+        exc,
+        (
+            OSError,
+            HTTPException,
+            NCFPEFetchException,
+            CorruptedXMLError,
+            NotXMLError,
+            ElementTree.ParseError,
+            RuntimeError,
+        ),
+    )
+
+
+def backoff_delay(tries: int) -> float:
+    """Return seconds to wait before retry number tries, with jitter."""
+    return min(
+        RETRY_MAX_DELAY,
+        RETRY_BASE_DELAY * 2 ** (tries - 1) * (1 + random.uniform(0, 0.5)),
+    )
+
+
+def retry_wait(exc: Exception, tries: int, maxretries: int, errmsg: str) -> None:
+    """Wait before retrying a failed Entrez request, or raise if we can't.
+
+    exc        - exception raised by the failed request
+    tries      - number of attempts made so far
+    maxretries - maximum number of attempts to make
+    errmsg     - message for the exception raised if not retrying
+
+    Raises NCFPMaxretryException at once if the error is not recoverable.
+    Otherwise, sleeps before the next attempt, if there is one.
+    """
+    if not is_recoverable(exc):
+        raise NCFPMaxretryException("%s (not retried: %s)" % (errmsg, exc)) from exc
+    if tries < maxretries:
+        time.sleep(max(backoff_delay(tries), retry_after(exc)))
+
+
+def retry_after(exc: Exception) -> float:
+    """Return seconds NCBI asked us to wait before retrying, or zero.
+
+    exc       - exception raised by the failed request
+
+    A 429 or 503 response may carry a Retry-After header giving a delay
+    in seconds, which we honour if it is longer than our own backoff.
+    """
+    if isinstance(exc, HTTPError) and exc.headers is not None:
+        value = exc.headers.get("Retry-After", "").strip()
+        if value.isdigit():
+            return float(value)
+    return 0.0
+
+
+def call_with_retries(func, maxretries: int, errmsg: str):
+    """Return the result of an Entrez request, retrying if it fails.
+
+    func       - callable making the request, and reading its result
+    maxretries - maximum number of attempts to make
+    errmsg     - message for the exception raised if all attempts fail
+
+    Each attempt waits on RATE_LIMITER. Failed attempts are logged, and
+    retried by retry_wait() if the failure may be transient.
+    """
+    logger = logging.getLogger(__name__)
+
+    tries = 0
+    while tries < maxretries:
+        try:
+            RATE_LIMITER.acquire()
+            return func()
+        except Exception as exc:
+            tries += 1
+            logger.warning("%s (retry %d): %s", errmsg, tries, exc)
+            logger.debug("%s (retry %d):", errmsg, tries, exc_info=True)
+            retry_wait(exc, tries, maxretries, errmsg)
+    raise NCFPMaxretryException(errmsg)
+
+
+# HTTP SESSION
+# ============
+# Biopython opens a new connection to NCBI, with a new TCP and TLS handshake,
+# for every E-utilities request. Instead, we send Biopython's requests through
+# a shared requests.Session, which keeps connections alive and reuses them.
+# The pool holds one connection for each worker thread.
+# The adapter itself retries only failures to connect, which are safe to
+# repeat for any request, so that a dropped keep-alive connection is
+# replaced at once. Errors and HTTP status codes from a request NCBI has
+# received are left to retry_wait(), so that retries do not compound.
+# Requests time out rather than hang on a stalled connection.
+SESSION_CONNECT_RETRIES = 3
+SESSION_TIMEOUT = (10, 300)  # seconds to (connect, wait for data)
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=ENTREZ_WORKERS,
+        max_retries=Retry(
+            total=SESSION_CONNECT_RETRIES,
+            read=False,
+            status=False,
+            redirect=False,
+            backoff_factor=0.5,
+        ),
+    ),
+)
+
+# Close pooled connections cleanly when the interpreter exits
+atexit.register(SESSION.close)
+
+
+def session_urlopen(request):
+    """Return handle to response for urllib Request, made with SESSION.
+
+    request   - urllib.request.Request, as built by Bio.Entrez
+
+    This stands in for urllib.request.urlopen() in Bio.Entrez, and raises
+    the same exceptions, so that Biopython's own error handling still
+    applies. The response body is read in full and returned in a BytesIO
+    handle, with the headers and url attributes Bio.Entrez expects.
+    """
+    headers = dict(request.header_items())
+    if request.data is not None:
+        headers.setdefault("Content-Type", "application/x-www-form-urlencoded")
+    try:
+        response = SESSION.request(
+            request.get_method(),
+            request.full_url,
+            data=request.data,
+            headers=headers,
+            timeout=SESSION_TIMEOUT,
+        )
+    except requests.RequestException as exc:
+        raise URLError(exc) from exc
+
+    # NCBI reports how many requests remain in the current rate limit window;
+    # if we are about to run out, slow down rather than wait for a 429 error
+    remaining = response.headers.get("X-RateLimit-Remaining", "")
+    if remaining.isdigit() and int(remaining) <= 1:
+        RATE_LIMITER.backoff()
+
+    message = HTTPMessage()
+    for key, value in response.headers.items():
+        message[key] = value
+    if response.status_code >= 400:
+        raise HTTPError(
+            response.url,
+            response.status_code,
+            response.reason,
+            message,
+            BytesIO(response.content),
+        )
+    handle = BytesIO(response.content)
+    handle.headers = message
+    handle.url = response.url
+    return handle
+
+
+def install_session() -> None:
+    """Route Bio.Entrez requests through SESSION, and leave retries to us.
+
+    This changes Bio.Entrez for the whole process, so it is done only when
+    ncfp sets up Entrez (in set_entrez_email()), not on import.
+    """
+    # Bio.Entrez looks up urlopen in its own namespace for each request
+    Entrez.urlopen = session_urlopen
+
+    # Bio.Entrez would otherwise retry failed requests itself, without our
+    # backoff, inside each of our own attempts; call_with_retries() does this
+    Entrez.max_tries = 1
+
+
+# ESEARCH AND ELINK RESULTS
+# =========================
+# We need only the UIDs from ESearch and ELink results, so rather than build
+# Biopython's validated tree of the whole XML response with Entrez.read(), we
+# collect the <Id> values as the XML is parsed, discarding each element once
+# it has been read. The results have the same shape as those of
+# Entrez.read(), for the parts we use.
+def parse_esearch_idlist(handle):
+    """Return ESearch result with the list of matching UIDs.
+
+    handle    - handle to ESearch XML response
+
+    Returns a dictionary, with the list of UIDs keyed by "IdList". Raises
+    NCFPESearchException if NCBI reports an error.
+    """
+    idlist = []
+    for _, elem in ElementTree.iterparse(handle):
+        if elem.tag == "ERROR" and elem.text:
+            raise NCFPESearchException("ESearch error: %s" % elem.text)
+        if elem.tag == "Id":
+            idlist.append(elem.text)
+        elem.clear()
+    return {"IdList": idlist}
+
+
+def parse_elink_linksets(handle):
+    """Return list of LinkSets from ELink result, one per query ID.
+
+    handle    - handle to ELink XML response
+
+    Each LinkSet is a dictionary, with a list of LinkSetDbs keyed by
+    "LinkSetDb". Each LinkSetDb has a list of Links keyed by "Link", and
+    each Link has its UID keyed by "Id". An error reported by NCBI for a
+    single query ID leaves its LinkSet empty; an error for the whole query
+    raises NCFPELinkException.
+    """
+    linksets = []
+    linkset, linksetdb, in_link = None, None, False
+    for event, elem in ElementTree.iterparse(handle, events=("start", "end")):
+        if event == "start":
+            if elem.tag == "LinkSet":
+                linkset = {"LinkSetDb": []}
+                linksets.append(linkset)
+            elif elem.tag == "LinkSetDb":
+                linksetdb = {"Link": []}
+                linkset["LinkSetDb"].append(linksetdb)
+            elif elem.tag == "Link":
+                in_link = True
+            continue
+        if elem.tag == "ERROR" and elem.text:
+            if linkset is None:
+                raise NCFPELinkException("ELink error: %s" % elem.text)
+            linkset["LinkSetDb"] = []
+        elif elem.tag == "Id" and in_link:
+            linksetdb["Link"].append({"Id": elem.text})
+        elif elem.tag == "Link":
+            in_link = False
+        elif elem.tag == "LinkSet":
+            linkset = None
+            elem.clear()
+    return linksets
+
+
+# GENBANK HEADERS
+# ===============
+# Only a few header fields are cached from each GenBank record, so rather than
+# build a full SeqRecord with SeqIO for each one, we read those fields directly
+# from the flatfile text. The LOCUS line gives the name, length, and (as its
+# last field) the date of the record.
+GB_LOCUS_RE = re.compile(r"^LOCUS\s+(\S+)\s+(\d+)\s+(?:bp|aa)\b.*\s(\S+)\s*$")
+GB_INDENT = 12  # column at which GenBank header field values start
+
+# Single-rank lineages that, like Biopython, we recognise as taxonomy rather
+# than a continuation of the organism name (which contains no semicolons)
+GB_LINEAGES = (
+    "Archaea.",
+    "Bacteria.",
+    "Eukaryota.",
+    "Unclassified.",
+    "Viruses.",
+    "cellular organisms.",
+    "other sequences.",
+    "unclassified sequences.",
+)
+
+
+def parse_gb_headers(handle):
+    """Yield header rows for the cache from GenBank flatfile records.
+
+    handle    - text handle, or iterable of lines, of GenBank records
+
+    Yields (accession, length, organism, taxonomy, date) tuples, with the
+    same values as the SeqIO record's .id, len(), and "organism",
+    "taxonomy" (space-separated) and "date" annotations. Lines after the
+    header (FEATURES onwards) are skipped without being parsed. A record
+    whose LOCUS line can't be parsed is logged and skipped.
+    """
+    logger = logging.getLogger(__name__)
+
+    in_header, accession = False, None
+    for line in handle:
+        line = line.rstrip()
+        if line.startswith("LOCUS"):
+            match = GB_LOCUS_RE.match(line)
+            if match is None:
+                logger.warning(
+                    "Could not parse GenBank LOCUS line (skipping): %s", line
+                )
+                in_header, accession = False, None
+                continue
+            accession, length, date = (
+                match.group(1),
+                int(match.group(2)),
+                match.group(3),
+            )
+            versioned = False
+            organism, lineage, in_organism = "", "", False
+            in_header = True
+        elif line.startswith("//"):
+            if accession is None:  # record with unparsed LOCUS line
+                continue
+            taxonomy = lineage.strip()
+            if taxonomy.endswith("."):
+                taxonomy = taxonomy[:-1]
+            taxonomy = " ".join(
+                [taxon.strip() for taxon in taxonomy.split(";") if taxon.strip()]
+            )
+            yield (accession, length, organism, taxonomy, date)
+            in_header, accession = False, None
+        elif not in_header:
+            continue
+        elif line.startswith(("FEATURES", "ORIGIN")):
+            in_header = False
+        elif line.startswith("VERSION") and len(line.split()) > 1:
+            accession, versioned = line.split()[1], True
+        elif line.startswith("ACCESSION") and not versioned:
+            accession = line.split()[1]
+        elif line.startswith("  ORGANISM"):
+            organism, in_organism = line[GB_INDENT:].strip(), True
+        elif in_organism and line[:GB_INDENT].isspace():
+            text = line[GB_INDENT:].strip()
+            if lineage or ";" in text or text in GB_LINEAGES:
+                lineage += " " + text
+            elif text != ".":  # "." is a placeholder for no lineage
+                organism += " " + text
+        else:
+            in_organism = False
+
+
+def split_gb_records(handle):
+    """Yield (accession, record text) for each GenBank flatfile record.
+
+    handle    - text handle, or iterable of lines, of GenBank records
+
+    Each record's text is returned as NCBI sent it, from its LOCUS line
+    to its closing //, without being parsed. The accession is taken from
+    the VERSION line (or, failing that, ACCESSION or LOCUS), so that it
+    matches the .id of the record as parsed by SeqIO.
+    """
+    lines = []
+    for line in handle:
+        if line.startswith("LOCUS"):
+            lines = []
+            accession, versioned = line.split()[1], False
+        lines.append(line)
+        if line.startswith("VERSION") and len(line.split()) > 1:
+            accession, versioned = line.split()[1], True
+        elif line.startswith("ACCESSION") and not versioned:
+            accession = line.split()[1]
+        elif line.startswith("//"):
+            yield (accession, "".join(lines))
+            lines = []
+
+
 def fetch_gb_headers(cachepath, retries, batchsize, disabletqdm=True):
     """Update cache with NCBI GenBank headers for passed records.
 
@@ -115,44 +564,22 @@ def fetch_gb_headers(cachepath, retries, batchsize, disabletqdm=True):
     """
     addedrows = []
     failcount = 0
-    # Create batches and get EPost keys for each batch
-    epost_histories = []
     nogbhead_uids = get_nogbhead_nt_uids(cachepath)
-    for batch in [
-        nogbhead_uids[idx : idx + batchsize]
-        for idx in range(0, len(nogbhead_uids), batchsize)
-    ]:
-        epost_histories.append(epost_history_with_retries(batch, "nucleotide", retries))
-    for history in tqdm(
-        epost_histories,
+    for data in tqdm(
+        efetch_batches(
+            batched(nogbhead_uids, batchsize), "nucleotide", "gb", "text", retries
+        ),
+        total=math.ceil(len(nogbhead_uids) / batchsize),
         desc="4/5 Fetching GenBank headers",
         disable=disabletqdm,
     ):
-        try:
-            records = SeqIO.parse(
-                efetch_history_with_retries(
-                    history,
-                    "nucleotide",
-                    "gb",
-                    "text",
-                    retries,
-                ),
-                "gb",
-            )
-            for record in records:
-                taxonomy = " ".join(record.annotations["taxonomy"])
-                addedrows.append(
-                    add_gbheaders(
-                        cachepath,
-                        record.id,
-                        len(record),
-                        record.annotations["organism"],
-                        taxonomy,
-                        record.annotations["date"],
-                    ),
-                )
-        except NCFPMaxretryException:
+        if data is None:
             failcount += 1
+            continue
+        # headers from this batch, written to cache together
+        rows = list(parse_gb_headers(data))
+        add_gbheaders_many(cachepath, rows)
+        addedrows.extend(row[0] for row in rows)
 
     return addedrows, (failcount * batchsize)
 
@@ -176,139 +603,319 @@ def fetch_shortest_genbank(cachepath, retries, batchsize, disabletqdm=True):
     # Identify those that need to be downloaded as full records
     shortids = find_shortest_genbank(cachepath)
     nogbfull_acc = get_nogbfull_nt_acc(cachepath)
-    fetchaccs = list(shortids.intersection(nogbfull_acc))
-
-    # Create batches and get EPost keys
-    epost_histories = []
-    for batch in [
-        fetchaccs[idx : idx + batchsize] for idx in range(0, len(fetchaccs), batchsize)
-    ]:
-        epost_histories.append(epost_history_with_retries(batch, "nucleotide", retries))
-    for history in tqdm(
-        epost_histories,
+    # Sorted, so that runs over the same input fetch the same batches
+    fetchaccs = sorted(shortids.intersection(nogbfull_acc))
+
+    for data in tqdm(
+        efetch_batches(
+            batched(fetchaccs, batchsize), "nucleotide", "gbwithparts", "text", retries
+        ),
+        total=math.ceil(len(fetchaccs) / batchsize),
         desc="5/5 Fetching full GenBank records",
         disable=disabletqdm,
     ):
-        try:
-            records = SeqIO.parse(
-                efetch_history_with_retries(
-                    history,
-                    "nucleotide",
-                    "gbwithparts",
-                    "text",
-                    retries,
-                ),
-                "gb",
-            )
-            for record in records:
-                addedrows.append(add_gbfull(cachepath, record.id, record.format("gb")))
-        except NCFPMaxretryException:
+        if data is None:
             failcount += 1
+            continue
+        rows = list(split_gb_records(data))
+        add_gbfull_many(cachepath, rows)
+        addedrows.extend(row[0] for row in rows)
 
     return addedrows, (failcount * batchsize)
 
 
-# Query NCBI singly with each record, to recover nucleotide accessions
-def search_nt_ids(records, cachepath, retries, disabletqdm: bool = True):
+def batched(items, size):
+    """Yield successive lists of at most size items from items.
+
+    items     - iterable of items
+    size      - maximum number of items in each list
+
+    Each list is built only when it is taken, so that batches of a long
+    list of IDs are not all copied out of it up front.
+    """
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+def efetch_batches(batches, dbname, rettype, retmode, retries):
+    """Yield EFetch results for batches of IDs, downloaded concurrently.
+
+    batches   - iterable of lists of IDs
+    dbname    - target NCBI database
+    rettype   - return datatype
+    retmode   - return data mode
+    retries   - number of Entrez retries
+
+    Each batch is EPosted and then EFetched from the resulting history in
+    a worker thread, so that the EPost of one batch overlaps the EFetch of
+    others. Results are yielded in batch order, so that they can be parsed
+    and cached in the calling thread; None is yielded for a batch that
+    could not be downloaded.
+    """
+
+    def fetch(batch):
+        history = epost_history_with_retries(batch, dbname, retries)
+        return efetch_history_with_retries(
+            history,
+            dbname,
+            rettype,
+            retmode,
+            retries,
+        )
+
+    for _, data in map_batches(fetch, batches):
+        yield data
+
+
+def map_batches(func, batches):
+    """Yield (batch, func(batch)) for each batch, run in worker threads.
+
+    func      - callable making Entrez queries for a batch of IDs
+    batches   - iterable of lists of IDs
+
+    Results are yielded in batch order; the result is None for a batch for
+    which func raised NCFPMaxretryException.
+    """
+
+    def run(batch):
+        try:
+            return batch, func(batch)
+        except NCFPMaxretryException:
+            return batch, None
+
+    # Batches are submitted only as results are taken, so that no more than
+    # EFETCH_PENDING downloaded batches wait in memory to be parsed
+    with ThreadPoolExecutor(max_workers=ENTREZ_WORKERS) as executor:
+        batches = iter(batches)
+        pending = deque(
+            executor.submit(run, batch) for batch in islice(batches, EFETCH_PENDING)
+        )
+        while pending:
+            data = pending.popleft().result()
+            for batch in islice(batches, 1):
+                pending.append(executor.submit(run, batch))
+            yield data
+
+
+# Query NCBI with each record, to recover nucleotide accessions
+def search_nt_ids(
+    records,
+    cachepath,
+    retries,
+    batchsize: int = 100,
+    disabletqdm: bool = True,
+):
     """Query NCBI nucleotide database and populate cache.
 
-    records - collection of SeqRecords
-    cache   - path to cache
-    retries - number of Entrez retries
+    records   - collection of SeqRecords
+    cache     - path to cache
+    retries   - number of Entrez retries
+    batchsize - number of protein accessions per ELink query
 
     If the record's ID is in the cache, the ESearch is not
     performed - the cache is presumed to be up to date.
 
     The cache gets updated in the link table between the query
     sequence ID, and the nucleotide sequence accession from
-    NCBI (seq_nt).
+    NCBI (seq_nt_link).
 
     If the record has a protein query (aa_query is populated in
-    the cache's seqdata table), then seq_nt is populated from
+    the cache's seqdata table), then seq_nt_link is populated from
     an ELink query; if the record has a nucleotide query
     (nt_query is populated, but aa_query is not), then a direct
-    ESearch of NCBI's nucleotide databases is performed.
+    ESearch of NCBI's nucleotide databases is performed. ELink
+    queries are made in batches of protein accessions.
     """
     logger = logging.getLogger(__name__)
 
-    addedrows = []  # Holds list of added rows in nt_uid_acc
+    addedrows = []  # Holds list of added nt UIDs
     noresult = 0  # Count of records with no result
-    for record in tqdm(records, desc="2/5 Search NT IDs", disable=disabletqdm):
-        if not has_ncbi_uid(cachepath, record.id) and has_nt_query(
-            cachepath,
-            record.id,
-        ):  # direct ESearch
+
+    # Identify records already having nt UIDs in the cache with a single
+    # bulk query, rather than checking each record in turn
+    records = list(records)
+    uid_accessions = get_accessions_with_ncbi_uids(
+        cachepath,
+        [record.id for record in records],
+    )
+
+    # Decide which query to make for each record without cached nt UIDs,
+    # fetching all of their query terms from the cache at once. The cache is
+    # only read and written in this thread: the Entrez queries themselves
+    # are made concurrently, in a thread pool.
+    seqqueries = get_seqdata_queries(
+        cachepath,
+        [record.id for record in records if record.id not in uid_accessions],
+    )
+    # Records that share a query term (e.g. domains of the same protein, in
+    # Stockholm format) are answered by a single query, made once per term
+    esearches = {}  # nt query term: [record IDs]
+    elinks = {}  # protein accession: [record IDs]
+    for record in records:
+        if record.id in uid_accessions or record.id not in seqqueries:
+            continue
+        uid_accessions.add(record.id)  # only query repeated IDs once
+        nt_query, aa_query = seqqueries[record.id]
+        if nt_query is not None:  # direct ESearch
             logger.debug("Entry has nt query, using direct ESearch: %s", record.id)
-            result = esearch_with_retries(
-                get_nt_query(cachepath, record.id),
-                "nucleotide",
-                retries,
-            )
-            if result["IdList"]:
-                addedrows.extend(add_ncbi_uids(cachepath, record.id, result["IdList"]))
-            else:
-                noresult += 1
-        elif not has_ncbi_uid(cachepath, record.id) and has_aa_query(
-            cachepath,
-            record.id,
-        ):  # ELink search
+            esearches.setdefault(nt_query, []).append(record.id)
+        elif aa_query is not None:  # ELink search
             logger.debug(
                 "Entry has aa query, using ELink: %s",
                 strip_stockholm_from_seqid(record.id),
             )
-            result = elink_fetch_with_retries(
-                strip_stockholm_from_seqid(record.id),
-                "protein",
-                "protein_nuccore",
-                retries,
+            elinks.setdefault(strip_stockholm_from_seqid(record.id), []).append(
+                record.id
             )
-            try:
-                idlist = [lid["Id"] for lid in result[0]["LinkSetDb"][0]["Link"]]
-                logger.debug("result: %s, idlist: %s", result, idlist)
-            except IndexError:  # No result returned - possible deleted record
-                logger.warning(
-                    "No result returned for %s: possible deleted record - please check",
-                    record.id,
-                )
-                idlist = None
-            if idlist:
-                addedrows.extend(add_ncbi_uids(cachepath, record.id, idlist))
-                logger.debug("record.id: %s, idlist: %s", record.id, idlist)
-            else:
-                noresult += 1
+
+    # Each task is a query type, and the (query term, record IDs) pairs
+    # answered by a single query of that type
+    tasks = [("esearch", [query]) for query in esearches.items()]
+    elinkqueries = list(elinks.items())
+    tasks.extend(
+        ("elink", elinkqueries[idx : idx + batchsize])
+        for idx in range(0, len(elinkqueries), batchsize)
+    )
+
+    with ThreadPoolExecutor(max_workers=ENTREZ_WORKERS) as executor, tqdm(
+        total=len(esearches) + len(elinks),
+        desc="2/5 Search NT IDs",
+        disable=disabletqdm,
+    ) as pbar:
+        results = executor.map(
+            lambda task: search_query_nt_uids(
+                task[0],
+                [term for term, _ in task[1]],
+                retries,
+            ),
+            tasks,
+        )
+        for (_, queries), idlists in zip(tasks, results, strict=True):
+            # UIDs for all records answered by this task, written together
+            links = []
+            for (_, seqids), idlist in zip(queries, idlists, strict=True):
+                for seqid in seqids:
+                    if idlist:
+                        links.append((seqid, idlist))
+                        logger.debug("record.id: %s, idlist: %s", seqid, idlist)
+                    else:
+                        noresult += 1
+            addedrows.extend(add_ncbi_uids_many(cachepath, links))
+            pbar.update(len(queries))
     return addedrows, noresult
 
 
-# Update existing cache nt_uid_acc table with accessions from NCBI
-def update_gb_accessions(cachepath, retries, disabletqdm=True):
+def search_query_nt_uids(querytype, queries, retries):
+    """Return list of NCBI nucleotide UID lists, one per passed query.
+
+    querytype - "esearch" for nucleotide database query terms, or
+                "elink" for protein accessions
+    queries   - list of query terms or accessions
+    retries   - number of Entrez retries
+
+    Each ESearch term is queried in turn, but all protein accessions are
+    passed to a single ELink query, which returns one LinkSet per
+    accession, in query order. If the LinkSets cannot be matched to the
+    accessions, each accession is queried singly instead.
+
+    This function makes no use of the cache, so may be called from
+    worker threads.
+    """
+    logger = logging.getLogger(__name__)
+
+    if querytype == "esearch":
+        return [
+            esearch_with_retries(query, "nucleotide", retries)["IdList"]
+            for query in queries
+        ]
+
+    # Passing the accessions as a list, not a comma-separated string, asks
+    # ELink for a separate LinkSet for each of them
+    result = elink_fetch_with_retries(
+        list(queries),
+        "protein",
+        "protein_nuccore",
+        retries,
+    )
+    if len(queries) > 1 and len(result) != len(queries):
+        logger.debug(
+            "ELink returned %d LinkSets for %d accessions, querying singly",
+            len(result),
+            len(queries),
+        )
+        return [
+            idlist
+            for query in queries
+            for idlist in search_query_nt_uids(querytype, [query], retries)
+        ]
+
+    idlists = []
+    for idx, query in enumerate(queries):
+        try:
+            idlist = [lid["Id"] for lid in result[idx]["LinkSetDb"][0]["Link"]]
+            logger.debug("result: %s, idlist: %s", result[idx], idlist)
+        except IndexError:  # No result returned - possible deleted record
+            logger.warning(
+                "No result returned for %s: possible deleted record - please check",
+                query,
+            )
+            idlist = []
+        idlists.append(idlist)
+    return idlists
+
+
+# Update existing cache seq_nt_link table with accessions from NCBI
+def update_gb_accessions(cachepath, retries, batchsize, disabletqdm=True):
     """Update cache table with GenBank accession for each UID.
 
     cachepath     - path to cache database
     retries       - number of Entres retries
-
-    For each UID in nt_uid_acc where there is no GenBank accession,
-    obtain the GenBank accession and update the row.
+    batchsize     - number of UIDs per EPost query
+
+    For each UID in seq_nt_link where there is no GenBank accession,
+    obtain the GenBank accession and update the row. UIDs are EPosted
+    in batches, and the accessions for each batch are taken from a
+    single ESummary of the resulting history. Batches are downloaded
+    concurrently, and the cache is updated in this thread. Each summary
+    carries its UID, so accessions are matched to UIDs whatever order
+    they are returned in, and missing records are detected.
     """
     logger = logging.getLogger(__name__)
 
     updatedrows = []
     noupdate = 0
-    for uid in tqdm(
-        get_nt_noacc_uids(cachepath),
+    noacc_uids = get_nt_noacc_uids(cachepath)
+
+    def summarise(batch):
+        history = epost_history_with_retries(batch, "nucleotide", retries)
+        return esummary_history_with_retries(history, "nucleotide", retries)
+
+    for batch, summaries in tqdm(
+        map_batches(summarise, batched(noacc_uids, batchsize)),
+        total=math.ceil(len(noacc_uids) / batchsize),
         desc="3/5 Fetch UID accessions",
         disable=disabletqdm,
     ):
-        result = (
-            efetch_with_retries(uid, "nucleotide", "acc", "text", retries)
-            .read()
-            .strip()
-        )
-        if result is None:
-            logger.debug("Could not update GenBank for %s", uid)
-            noupdate += 1
-        else:
-            logger.debug("Updating GenBank for %s as %s", uid, result)
-            updatedrows.extend(update_nt_uid_acc(cachepath, uid, result))
+        if summaries is None:
+            logger.debug("Could not update GenBank for batch %s", batch)
+            noupdate += len(batch)
+            continue
+        accessions = {
+            str(summary["Id"]): str(summary["AccessionVersion"])
+            for summary in summaries
+        }
+        rows = []  # (UID, accession) for this batch, written together
+        for uid in batch:
+            if uid not in accessions:
+                logger.debug("Could not update GenBank for %s", uid)
+                noupdate += 1
+                continue
+            logger.debug("Updating GenBank for %s as %s", uid, accessions[uid])
+            rows.append((uid, accessions[uid]))
+        # Every UID in the batch is linked in the cache, so all are updated
+        update_nt_uid_acc_many(cachepath, rows)
+        updatedrows.extend(uid for uid, _ in rows)
     return updatedrows, noupdate
 
 
@@ -326,20 +933,11 @@ def esearch_with_retries(query_id, dbname, maxretries):
     logger = logging.getLogger(__name__)
     logger.debug("ESearch query: %s (db: %s)", query_id, dbname)
 
-    tries = 0
-    while tries < maxretries:
-        try:
-            handle = Entrez.esearch(db=dbname, term=query_id)
-            return Entrez.read(handle)
-        except Exception:
-            tries += 1
-            logger.warning(
-                "ESearch query (%s) failed (retry %d)",
-                query_id,
-                tries,
-                exc_info=True,
-            )
-    raise NCFPMaxretryException("Query ID %s ESearch failed\n%s" % query_id)
+    return call_with_retries(
+        lambda: parse_esearch_idlist(Entrez.esearch(db=dbname, term=query_id)),
+        maxretries,
+        "Query ID %s ESearch failed" % query_id,
+    )
 
 
 def elink_fetch_with_retries(query_id, dbname, linkdbname, maxretries):
@@ -351,31 +949,22 @@ def elink_fetch_with_retries(query_id, dbname, linkdbname, maxretries):
     maxretries      - maximum number of attempts to make
     """
     logger = logging.getLogger(__name__)
-    logger.debug("ELink query: %s", query_id)
-
-    tries = 0
-    while tries < maxretries:
-        try:
-            logger.debug(
-                "dbname: %s linkdbname: %s query_id: %s",
-                dbname,
-                linkdbname,
-                query_id,
-            )
-            matches = Entrez.read(
-                Entrez.elink(dbfrom=dbname, linkname=linkdbname, id=query_id),
-            )
-            logger.debug("matches: %s", matches)
-            return matches
-        except Exception:
-            tries += 1
-            logger.warning(
-                "ELink query (%s) failed (retry %d)",
-                query_id,
-                tries,
-                exc_info=True,
-            )
-    raise NCFPMaxretryException("Query ID %s ELink failed" % query_id)
+    logger.debug(
+        "ELink query: %s (dbname: %s linkdbname: %s)",
+        query_id,
+        dbname,
+        linkdbname,
+    )
+
+    matches = call_with_retries(
+        lambda: parse_elink_linksets(
+            Entrez.elink(dbfrom=dbname, linkname=linkdbname, id=query_id),
+        ),
+        maxretries,
+        "Query ID %s ELink failed" % query_id,
+    )
+    logger.debug("matches: %s", matches)
+    return matches
 
 
 # Run an EFetch on a single ID
@@ -388,35 +977,24 @@ def efetch_with_retries(query_id, dbname, rettype, retmode, maxretries):
     retmode       - format of data to be returned
     maxretries    - maximum number of attempts to make
 
-    Returns a handle to a completely buffered string, after a read()
-    operation, sanity check, and retokenising.
+    Returns a text handle to the completely downloaded response, rewound
+    after a sanity check of its first line. The response is not copied
+    into a new string, so the only copy in memory is the downloaded bytes.
     """
-    logger = logging.getLogger(__name__)
-
-    tries = 0
-    while tries < maxretries:
-        try:
-            data = Entrez.efetch(
+    return call_with_retries(
+        lambda: check_efetch_handle(
+            Entrez.efetch(
                 db=dbname,
                 rettype=rettype,
                 retmode=retmode,
                 id=query_id,
-            ).read()
-            if rettype in ["gb", "gbwithparts"] and retmode == "text":
-                if not data.startswith("LOCUS"):
-                    msg = "Data does not begin with expected LOCUS string"
-                    raise NCFPEFetchException(msg)
-            # Return data string as stream
-            return StringIO(data)
-        except Exception:
-            tries += 1
-            logger.warning(
-                "EFetch query (%s) failed (retry %d)",
-                query_id,
-                tries,
-                exc_info=True,
-            )
-    raise NCFPMaxretryException("Query ID %s EFetch failed" % query_id)
+            ),
+            rettype,
+            retmode,
+        ),
+        maxretries,
+        "Query ID %s EFetch failed" % query_id,
+    )
 
 
 # Batch EPost to get history for a set of query IDs
@@ -429,16 +1007,11 @@ def epost_history_with_retries(qids, dbname, maxretries):
 
     Returns the generated history, as parsed by Entrez.read()
     """
-    tries = 0
-    while tries < maxretries:
-        try:
-            # Get and return history
-            return Entrez.read(Entrez.epost(dbname, id=",".join(qids)))
-        except Exception:
-            tries += 1
-
-    errmsg = "Batch EPost failed."
-    raise NCFPMaxretryException(errmsg)
+    return call_with_retries(
+        lambda: Entrez.read(Entrez.epost(dbname, id=",".join(qids))),
+        maxretries,
+        "Batch EPost failed.",
+    )
 
 
 def efetch_history_with_retries(history, dbname, rettype, retmode, maxretries):
@@ -450,30 +1023,84 @@ def efetch_history_with_retries(history, dbname, rettype, retmode, maxretries):
     retmode          - return data mode
     maxretries       - maximum download attempts
 
-    Returns the result data as a tokenised string.
+    Returns a text handle to the completely downloaded response, rewound
+    after a sanity check of its first line.
     """
-    tries = 0
-    while tries < maxretries:
-        try:
-            data = Entrez.efetch(
+    return call_with_retries(
+        lambda: check_efetch_handle(
+            Entrez.efetch(
                 db=dbname,
                 rettype=rettype,
                 retmode=retmode,
                 webenv=history["WebEnv"],
                 query_key=history["QueryKey"],
-            ).read()
-            if rettype in ["gb", "gbwithparts"] and retmode == "text":
-                if not data.startswith("LOCUS"):
-                    errmsg = "Returned data does not begin with string LOCUS"
-                    raise NCFPEFetchException(errmsg)
-            return StringIO(data)
-        except Exception:
-            tries += 1
+            ),
+            rettype,
+            retmode,
+        ),
+        maxretries,
+        "Failed to recover batch EFetch",
+    )
 
-    errmsg = "Failed to recover batch EFetch"
-    raise NCFPMaxretryException(errmsg)
 
+def esummary_history_with_retries(history, dbname, maxretries):
+    """Run Entrez ESummary on a passed EPost history.
+
+    history          - EPost history
+    dbname           - target NCBI database
+    maxretries       - maximum download attempts
+
+    Returns the list of document summaries, as parsed by Entrez.read()
+    """
+    return call_with_retries(
+        lambda: Entrez.read(
+            Entrez.esummary(
+                db=dbname,
+                webenv=history["WebEnv"],
+                query_key=history["QueryKey"],
+            ),
+        ),
+        maxretries,
+        "Batch ESummary failed",
+    )
 
-def set_entrez_email(email: str) -> None:
-    """Set Entrez email address."""
+
+def check_efetch_handle(handle, rettype, retmode):
+    """Return EFetch handle, rewound, if its data are as expected.
+
+    handle    - handle returned by Entrez.efetch()
+    rettype   - requested return type
+    retmode   - format of data requested
+
+    GenBank text records must begin with a LOCUS line; anything else
+    raises NCFPEFetchException, so that the request is retried. Bio.Entrez
+    only wraps text/plain responses in a text handle: others, such as an
+    HTML error page, come back as a bytes handle, and are also rejected.
+    """
+    if rettype in ["gb", "gbwithparts"] and retmode == "text":
+        line = handle.readline()
+        if isinstance(line, bytes):
+            errmsg = "Returned data is not text (%s)" % handle.headers.get(
+                "Content-Type", "unknown content type"
+            )
+            raise NCFPEFetchException(errmsg)
+        if not line.startswith("LOCUS"):
+            errmsg = "Returned data does not begin with string LOCUS"
+            raise NCFPEFetchException(errmsg)
+        handle.seek(0)
+    return handle
+
+
+def set_entrez_email(email: str, api_key: Optional[str] = None) -> None:
+    """Set Entrez email address, and optional NCBI API key.
+
+    email     - email address for NCBI/Entrez
+    api_key   - NCBI API key; with a key, RATE_LIMITER allows more
+                requests per second
+
+    Bio.Entrez requests are also routed through SESSION from here on (see
+    install_session()).
+    """
     Entrez.email = email
+    Entrez.api_key = api_key
+    install_session()
@@ -48,15 +48,14 @@ from pathlib import Path
 class NoColorFormatter(logging.Formatter):
     """Log formatter that strips terminal colour escape codes from the log message."""
 
-    ANSI_RE = re.compile(r"\x1b\[[0-9;]*m")
+    ANSI_RE = re.compile(r"\x1b\[[0-9;]*m", re.ASCII)
 
     def format(self, record) -> str:
         """Return logger message with terminal escapes removed."""
-        return "[%s] [%s]: %s" % (
-            record.levelname,
-            record.name,
-            re.sub(self.ANSI_RE, "", record.msg % record.args),
-        )
+        message = record.getMessage()
+        if "\x1b" in message:  # most messages have no escapes to remove
+            message = self.ANSI_RE.sub("", message)
+        return "[%s] [%s]: %s" % (record.levelname, record.name, message)
 
 
 def config_logger(args: Namespace) -> None:
@@ -105,3 +104,7 @@ def config_logger(args: Namespace) -> None:
             loghandler.setLevel(logging.INFO)
         loghandler.setFormatter(logformatter)
         logger.addHandler(loghandler)
+
+    # Only create log records that some handler will emit, so that e.g.
+    # logger.debug() calls in loops return at once unless --debug is set
+    logger.setLevel(min(handler.level for handler in logger.handlers))
@@ -41,7 +41,6 @@ from __future__ import annotations
 
 import logging
 import os
-import re
 import sys
 import time
 from io import StringIO
@@ -52,11 +51,13 @@ from Bio import SeqIO
 
 from ncbi_cds_from_protein import NCFPException, __version__
 from ncbi_cds_from_protein.caches import (
-    find_record_cds,
-    get_aa_query,
+    close_cachedb,
+    find_records_cds,
+    get_seqdata_queries,
     initialise_dbcache,
 )
 from ncbi_cds_from_protein.entrez import (
+    batched,
     fetch_gb_headers,
     fetch_shortest_genbank,
     search_nt_ids,
@@ -81,6 +82,19 @@ if TYPE_CHECKING:
     from Bio.SeqRecord import SeqRecord
 
 
+# Input FASTA (files or stdin) is read in large blocks, to cut the number of read()
+# calls made while parsing a large file
+INPUT_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Number of input sequences whose cached records are read in one go by
+# extract_cds_features
+CDS_BATCH_SIZE = 500
+
+# Number of parsed GenBank records kept for reuse by extract_cds_features.
+# This is small because records may be whole genomes.
+GBRECORD_CACHE_SIZE = 4
+
+
 # Process input sequences
 def load_input_sequences(args: Namespace) -> list:
     """Load input FASTA sequences.
@@ -91,7 +105,15 @@ def load_input_sequences(args: Namespace) -> list:
     logger.info("Parsing sequence input...")
 
     if args.infname is None or args.infname == "-":
-        instream = sys.stdin
+        # Reopen stdin's descriptor to read piped input in the same large
+        # blocks as input files; closefd=False leaves sys.stdin usable
+        instream = open(
+            sys.stdin.fileno(),
+            "r",
+            buffering=INPUT_BUFFER_SIZE,
+            encoding=sys.stdin.encoding,
+            closefd=False,
+        )
         logger.info("Reading sequences from stdin")
     else:
         if not args.infname.is_file():
@@ -99,7 +121,7 @@ def load_input_sequences(args: Namespace) -> list:
             logger.error(msg)
             raise NCFPException(msg)
         try:
-            instream = args.infname.open("r")
+            instream = args.infname.open("r", buffering=INPUT_BUFFER_SIZE)
         except OSError:
             logger.error("Could not open input file %s", args.infname, exc_info=True)
             raise SystemExit(1)
@@ -117,6 +139,104 @@ def load_input_sequences(args: Namespace) -> list:
     return records
 
 
+# Parse cached GenBank record text
+def read_gbrecord(gbrecords: dict, accession: str, gbtext: str) -> SeqRecord:
+    """Return SeqRecord parsed from GenBank record text.
+
+    :param gbrecords:  recently parsed SeqRecords, keyed by nt accession
+    :param accession:  nt accession of the GenBank record
+    :param gbtext:  GenBank record as text
+
+    Input sequences that map to the same GenBank record share one parse of
+    it while it is in gbrecords, which holds at most GBRECORD_CACHE_SIZE
+    records; the returned SeqRecord must not be modified.
+    """
+    gbrecord = gbrecords.get(accession)
+    if gbrecord is None:
+        gbrecord = SeqIO.read(StringIO(gbtext), "gb")
+        if len(gbrecords) >= GBRECORD_CACHE_SIZE:  # drop the oldest record
+            del gbrecords[next(iter(gbrecords))]
+        gbrecords[accession] = gbrecord
+    return gbrecord
+
+
+# Find the CDS feature for an input sequence in its GenBank record
+def find_cds_feature(record: SeqRecord, gbrecord: SeqRecord, aaqueryid):
+    """Return CDS feature in GenBank record matching input sequence, or None.
+
+    :param record:  input sequence record
+    :param gbrecord:  GenBank record linked to the input sequence
+    :param aaqueryid:  AA query ID for the input sequence, or None
+    """
+    logger = logging.getLogger(__name__)
+
+    match = re_uniprot_gn.search(record.description)
+    # If we have a match, we can use the UniProt gene name (GN=) to extract the
+    # CDS. In some cases (e.g. A0A127QBK9) the UniProt gene name is
+    # ambiguous, and the CDS will not be extracted correctly. If we have one,
+    # we prefer to use the AA query ID to extract the CDS.
+    feature = None
+    logger.debug("AA query ID: %s", aaqueryid)
+    if aaqueryid is not None:
+        logger.debug(
+            "Extracting CDS by locus tag with AA query ID: %s",
+            aaqueryid,
+        )
+        feature = extract_feature_by_locus_tag(gbrecord, aaqueryid)
+        if feature is None:
+            logger.debug(
+                "Did not find feature with locus tag %s, trying GN field",
+                aaqueryid,
+            )
+    # For Uniprot sequences, we extract the gene name
+    if (match is not None) and (feature is None):
+        logger.debug("Matched %s to %s", record.id, match.group())
+        # Get the matching CDS
+        gene_name = match.group(0)
+        logger.debug("Searching for CDS: %s", gene_name)
+        feature = extract_feature_by_locus_tag(gbrecord, gene_name)
+        if feature is None:
+            logger.debug(
+                "Could not find feature with locus tag, trying protein ID",
+            )
+            feature = extract_feature_by_protein_id(gbrecord, gene_name)
+    elif feature is None:  # NCBI sequences
+        # Get the matching CDS - note we have to remove the Stockholm
+        # domain info, if that is present
+        logger.debug(
+            "Extracting NCBI sequence by protein id: %s",
+            strip_stockholm_from_seqid(record.id),
+        )
+        feature = extract_feature_by_protein_id(
+            gbrecord,
+            strip_stockholm_from_seqid(record.id),
+        )
+        gene_name = None  # explicitly note that there is no gene_name
+    # Nearly a last-ditch effort - try gene ID
+    if (feature is None) and (gene_name is not None):
+        logger.debug(
+            "Could not find feature by locus tag or protein ID, trying gene ID (%s)",
+            gene_name,
+        )
+        feature = extract_feature_by_gene_id(gbrecord, gene_name)
+    # A very, very final attempt - if there is a single CDS feature,
+    # we'll try to use that. We might want to allow looping over all
+    # CDS features of a small GenBank file in a future version
+    if feature is None:
+        logger.debug(
+            "Could not find feature by gene ID, checking if there is a single CDS feature as last resort",
+        )
+        cds_features = [_ for _ in gbrecord.features if _.type == "CDS"]
+        if len(cds_features) == 1:
+            protein_id = cds_features[0].qualifiers["protein_id"][0]
+            logger.debug(
+                "Found a single CDS feature, trying that: %s",
+                protein_id,
+            )
+            feature = extract_feature_by_protein_id(gbrecord, protein_id)
+    return feature
+
+
 # Extract CDS sequences from cached GenBank records
 def extract_cds_features(
     seqrecords: Iterable[SeqRecord],
@@ -133,154 +253,106 @@ def extract_cds_features(
     logger.info("Extracting CDS features...")
 
     nt_sequences = []  # Holds extracted nucleotide sequences
-    for record in seqrecords:
-        logger.debug("Processing sequence %s", record.id)
-        result = find_record_cds(cachepath, record.id)
-        aaqueryid = get_aa_query(cachepath, record.id)
-        logger.debug("Found AA query ID %s for this sequence in cache", aaqueryid)
-        if not result:
-            logger.warning(
-                "No record found for sequence input %s - please check this sequence manually",
-                record.id,
-            )
-            logger.warning(
-                "\tThis record may have been removed from the NCBI database, or suppressed by NCBI",
-            )
-        elif len(result) > 1:
-            logger.warning(
-                "More than one record returned for %s - please check this sequence manually (skipping)",
-                record.id,
-            )
-            if record.id.startswith("WP_"):
+    gbrecords = {}  # Recently parsed GenBank records, by nt accession
+    for batch in batched(seqrecords, CDS_BATCH_SIZE):
+        # Read cached records and queries for the whole batch at once
+        batchids = [record.id for record in batch]
+        cdsrecords = find_records_cds(cachepath, batchids)
+        seqqueries = get_seqdata_queries(cachepath, batchids)
+        for record in batch:
+            logger.debug("Processing sequence %s", record.id)
+            result = cdsrecords.get(record.id, [])
+            aaqueryid = seqqueries.get(record.id, (None, None))[1]
+            logger.debug("Found AA query ID %s for this sequence in cache", aaqueryid)
+            if not result:
                 logger.warning(
-                    "\tThis record looks like it may be an Identical Protein Group (IPG)",
-                )
-        else:
-            gbrecord = SeqIO.read(StringIO(result[0][-1]), "gb")
-            logger.info("Sequence %s matches GenBank entry %s", record.id, gbrecord.id)
-            match = re.search(re_uniprot_gn, record.description)
-            # If we have a match, we can use the UniProt gene name (GN=) to extract the
-            # CDS. In some cases (e.g. A0A127QBK9) the UniProt gene name is
-            # ambiguous, and the CDS will not be extracted correctly. If we have one,
-            # we prefer to use the AA query ID to extract the CDS.
-            feature = None
-            logger.debug("AA query ID: %s", aaqueryid)
-            if aaqueryid is not None:
-                logger.info(
-                    "Extracting CDS by locus tag with AA query ID: %s",
-                    aaqueryid,
-                )
-                feature = extract_feature_by_locus_tag(gbrecord, aaqueryid[0])
-                if feature is None:
-                    logger.info(
-                        "Did not find feature with locus tag %s, trying GN field",
-                        aaqueryid,
-                    )
-            # For Uniprot sequences, we extract the gene name
-            if (match is not None) and (feature is None):
-                logger.debug("Matched %s to %s", record.id, match.group())
-                # Get the matching CDS
-                gene_name = match.group(0)
-                logger.info("Searching for CDS: %s", gene_name)
-                feature = extract_feature_by_locus_tag(gbrecord, gene_name)
-                if feature is None:
-                    logger.debug(
-                        "Could not find feature with locus tag, trying protein ID",
-                    )
-                    feature = extract_feature_by_protein_id(gbrecord, gene_name)
-            elif feature is None:  # NCBI sequences
-                # Get the matching CDS - note we have to remove the Stockholm
-                # domain info, if that is present
-                logger.debug(
-                    "Extracting NCBI sequence by protein id: %s",
-                    strip_stockholm_from_seqid(record.id),
-                )
-                feature = extract_feature_by_protein_id(
-                    gbrecord,
-                    strip_stockholm_from_seqid(record.id),
+                    "No record found for sequence input %s - please check this sequence manually",
+                    record.id,
                 )
-                gene_name = None  # explicitly note that there is no gene_name
-            # Nearly a last-ditch effort - try gene ID
-            if (feature is None) and (gene_name is not None):
-                logger.debug(
-                    "Could not find feature by locus tag or protein ID, trying gene ID (%s)",
-                    gene_name,
+                logger.warning(
+                    "\tThis record may have been removed from the NCBI database, or suppressed by NCBI",
                 )
-                feature = extract_feature_by_gene_id(gbrecord, gene_name)
-            # A very, very final attempt - if there is a single CDS feature,
-            # we'll try to use that. We might want to allow looping over all
-            # CDS features of a small GenBank file in a future version
-            if feature is None:
-                logger.debug(
-                    "Could not find feature by gene ID, checking if there is a single CDS feature as last resort",
+            elif len(result) > 1:
+                logger.warning(
+                    "More than one record returned for %s - please check this sequence manually (skipping)",
+                    record.id,
                 )
-                cds_features = [_ for _ in gbrecord.features if _.type == "CDS"]
-                if len(cds_features) == 1:
-                    protein_id = cds_features[0].qualifiers["protein_id"][0]
-                    logger.debug(
-                        "Found a single CDS feature, trying that: %s",
-                        protein_id,
+                if record.id.startswith("WP_"):
+                    logger.warning(
+                        "\tThis record looks like it may be an Identical Protein Group (IPG)",
                     )
-                    feature = extract_feature_by_protein_id(gbrecord, protein_id)
-            if feature is None:  # If even the last ditch fails, we give up
-                logger.info("Could not identify CDS feature for %s", record.id)
             else:
-                logger.info(
-                    "\tSequence %s matches CDS feature %s",
-                    record.id,
-                    feature.qualifiers["protein_id"][0],
+                gbrecord = read_gbrecord(gbrecords, result[0][1], result[0][-1])
+                logger.debug(
+                    "Sequence %s matches GenBank entry %s", record.id, gbrecord.id
                 )
-                logger.info("\tExtracting coding sequence...")
-                logger.debug("args.stockholm: %s", args.stockholm)
-                if args.stockholm:
-                    locdata = record.id.split("/")[-1]
-                    logger.debug(
-                        "Adding Stockholm domain info %s to sequence ID",
-                        locdata,
-                    )
-                    stockholm = [int(e) for e in locdata.split("-")]
+                feature = find_cds_feature(record, gbrecord, aaqueryid)
+                if feature is None:  # If even the last ditch fails, we give up
+                    logger.info("Could not identify CDS feature for %s", record.id)
                 else:
-                    stockholm = []
-                ntseq, aaseq = extract_feature_cds(
-                    feature,
-                    gbrecord,
-                    tuple(stockholm),
-                    args,
-                )
-                # Could not extract feature for some reason, skip
-                if ntseq is None and aaseq is None:
-                    logger.warning("Could not extract CDS for %s (skipping)", record.id)
-                    continue
-
-                if args.unify_seqid:
-                    # Make recovered sequence ID the same as the query sequence ID
-                    # Move the complete recovered sequence description to the new sequence
-                    # description
-                    tmp_description = ntseq.description
-                    ntseq.id = record.id
-                    ntseq.description = tmp_description
-                # Otherwise, if we have stockholm format append locations to the ntseq IDs
-                elif args.stockholm:
-                    ntseq.id = f"{ntseq.id}/{stockholm[0] * 3 - 2}-{stockholm[1] * 3}"
-                if aaseq.seq == record.seq.replace("-", "").upper():
-                    logger.info("\t\tTranslated sequence matches input sequence")
-                    nt_sequences.append((record, ntseq))
-                elif (
-                    args.alternative_start_codon
-                    and aaseq.seq[1:] == record.seq.replace("-", "").upper()[1:]
-                ):
-                    logger.info(
-                        "\t\tTranslated sequence matches input sequence with alternative start codon %s -> %s",
-                        aaseq.seq[0],
-                        record.seq.replace("-", "").upper()[0],
+                    logger.debug(
+                        "\tSequence %s matches CDS feature %s",
+                        record.id,
+                        feature.qualifiers["protein_id"][0],
                     )
-                    nt_sequences.append((record, ntseq))
-                else:
-                    logger.warning(
-                        "\t\tTranslated sequence does not match " + "input sequence!",
+                    logger.debug("\tExtracting coding sequence...")
+                    logger.debug("args.stockholm: %s", args.stockholm)
+                    if args.stockholm:
+                        locdata = record.id.split("/")[-1]
+                        logger.debug(
+                            "Adding Stockholm domain info %s to sequence ID",
+                            locdata,
+                        )
+                        stockholm = [int(e) for e in locdata.split("-")]
+                    else:
+                        stockholm = []
+                    ntseq, aaseq = extract_feature_cds(
+                        feature,
+                        gbrecord,
+                        tuple(stockholm),
+                        args,
                     )
-                    logger.warning("\t\t%s", aaseq.seq)
-                    logger.warning("\t\t%s", record.seq.replace("-", "").upper())
+                    # Could not extract feature for some reason, skip
+                    if ntseq is None and aaseq is None:
+                        logger.warning(
+                            "Could not extract CDS for %s (skipping)", record.id
+                        )
+                        continue
+
+                    if args.unify_seqid:
+                        # Make recovered sequence ID the same as the query sequence ID
+                        # Move the complete recovered sequence description to the new sequence
+                        # description
+                        tmp_description = ntseq.description
+                        ntseq.id = record.id
+                        ntseq.description = tmp_description
+                    # Otherwise, if we have stockholm format append locations to the ntseq IDs
+                    elif args.stockholm:
+                        ntseq.id = (
+                            f"{ntseq.id}/{stockholm[0] * 3 - 2}-{stockholm[1] * 3}"
+                        )
+                    # Compare as plain strings, ungapping the input sequence once
+                    translated = str(aaseq.seq)
+                    queryseq = str(record.seq).replace("-", "").upper()
+                    if translated == queryseq:
+                        logger.debug("\t\tTranslated sequence matches input sequence")
+                        nt_sequences.append((record, ntseq))
+                    elif (
+                        args.alternative_start_codon and translated[1:] == queryseq[1:]
+                    ):
+                        logger.debug(
+                            "\t\tTranslated sequence matches input sequence with alternative start codon %s -> %s",
+                            translated[0],
+                            queryseq[0],
+                        )
+                        nt_sequences.append((record, ntseq))
+                    else:
+                        logger.warning(
+                            "\t\tTranslated sequence does not match "
+                            + "input sequence!",
+                        )
+                        logger.warning("\t\t%s", translated)
+                        logger.warning("\t\t%s", queryseq)
 
     return nt_sequences
 
@@ -334,8 +406,8 @@ def run_main(argv=None):
     logger = logging.getLogger(__name__)
     config_logger(args)
 
-    # Set email address at Entrez
-    set_entrez_email(args.email)
+    # Set email address and (optional) API key at Entrez
+    set_entrez_email(args.email, args.api_key or os.environ.get("NCBI_API_KEY"))
 
     # Make sure we can write to the output directory
     try:
@@ -378,6 +450,7 @@ def run_main(argv=None):
         qrecords,
         cachepath,
         args.retries,
+        args.batchsize,
         disabletqdm=args.disabletqdm,
     )
     logger.info("Added %d new UIDs to cache", len(addedrows))
@@ -397,6 +470,7 @@ def run_main(argv=None):
     updatedrows, countfail = update_gb_accessions(
         cachepath,
         args.retries,
+        args.batchsize,
         disabletqdm=args.disabletqdm,
     )
     logger.info("Updated GenBank accessions for %d UIDs", len(updatedrows))
@@ -451,6 +525,10 @@ def run_main(argv=None):
     logger.info("Writing paired sequence files to %s", args.outdirname)
     write_sequences(nt_sequences, args)
 
+    # Close the cache connection, so that its write-ahead log is merged
+    # into the cache file, which may be kept (--keepcache) or copied
+    close_cachedb(cachepath)
+
     # Report success
     logger.info("Completed. Time taken: %.3f", (time.time() - time0))
     return 0
@@ -108,7 +108,16 @@ def parse_cmdline(args=None):
         action="store",
         default=100,
         type=int,
-        help="batch size for EPost submissions",
+        help="batch size for EPost and ELink submissions",
+    )
+    parser.add_argument(
+        "--api_key",
+        dest="api_key",
+        action="store",
+        default=None,
+        type=str,
+        help="NCBI API key, allowing more Entrez requests per second; "
+        + "if not given, NCBI_API_KEY is read from the environment",
     )
     parser.add_argument(
         "-r",
@@ -42,6 +42,7 @@ from __future__ import annotations
 import logging
 import re
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from typing import TYPE_CHECKING, Iterable
 
 from Bio.SeqRecord import SeqRecord
@@ -58,10 +59,17 @@ if TYPE_CHECKING:
 
     from Bio.SeqFeature import SeqFeature
 
-# regexes for parsing out Uniprot
-re_uniprot_head = re.compile(r".*\|.*\|.*")
+# regexes for parsing out Uniprot; these are compiled once, and their own
+# search() methods used, as they are applied to every input record. A UniProt
+# header has (at least) two "|" separators: searching for just the text
+# between them, rather than r".*\|.*\|.*", avoids backtracking over the
+# whole header for non-UniProt records
+re_uniprot_head = re.compile(r"\|.*\|")
 re_uniprot_gn = re.compile(r"(?<=GN=)[^\s]+")
 
+# Number of UniProt records whose cross-references may be looked up at once
+UNIPROT_WORKERS = 4
+
 
 def guess_seqtype(record: SeqRecord) -> str:
     """Return best guess at SeqRecord origin on basis of header.
@@ -82,10 +90,7 @@ def guess_seqtype(record: SeqRecord) -> str:
         logger.debug("...guessed UniParc")
         return "UniParc"
     # Test for UniProt, see https://www.uniprot.org/help/fasta-headers
-    match = re.search(
-        re_uniprot_head,
-        record.description,
-    )  # test for UniProt header
+    match = re_uniprot_head.search(record.description)  # test for UniProt header
 
     if match is None:
         logger.debug("...guessed NCBI")
@@ -111,6 +116,111 @@ def uniprot_to_embl(query_acc: str, u_service: UniProt) -> tuple[str, str]:
     return qstring, pstring
 
 
+def geneid_nt_accession(lines: Iterable[str]) -> str | None:
+    """Return nucleotide accession from an NCBI Gene text record.
+
+    lines       - lines of the Gene record, e.g. an open handle
+
+    The accession is taken from the first "Annotation" line; returns None
+    if there is no such line.
+    """
+    # Tokenise each line once, stopping at the first Annotation line
+    for line in lines:
+        fields = line.split()
+        if len(fields) > 1 and fields[0].startswith("Annotation"):
+            return fields[1]
+    return None
+
+
+def uniprot_accession(record: SeqRecord) -> str:
+    """Return UniProt accession from a UniProt SeqRecord's ID.
+
+    record      - UniProt SeqRecord, with an ID such as sp|P00001|A_HUMAN
+    """
+    return record.id.split("|")[1]
+
+
+def uniprot_nt_query(record: SeqRecord, u_service: UniProt) -> tuple[str, str] | None:
+    """Return nucleotide query and protein ID for a UniProt record.
+
+    record      - UniProt SeqRecord, with a GN field in its description
+    u_service   - UniProt service object
+
+    Returns a (nt query, protein ID) tuple of strings, either of which may
+    hold several semicolon-separated values, or None if no nucleotide
+    query can be found for the record.
+
+    This function makes no use of the cache, so may be called from
+    worker threads.
+    """
+    logger = logging.getLogger(__name__)
+
+    # The UniProt API was updated in June 2022, requiring a change
+    # to the returned field for the cross-reference to EMBL
+    # Get the UniProt ID from the accession and use this to query the API
+    query_acc = uniprot_accession(record)
+    logger.debug(
+        "Querying UniProt with %s to match xref_embl",
+        query_acc,
+    )
+    # Use the UniProt record ID as the query to the EMBL ID, retrieving
+    # the EMBL record accession, and the ORF gene name
+    # bioservices 1.12 now returns a string without trailing \n if there is
+    # no match, so we need to account for this for each of qstring, pstring,
+    # and gstring
+    qstring, pstring = uniprot_to_embl(query_acc, u_service)
+    if qstring == "":
+        logger.warning(
+            "Uniprot record %s has no EMBL cross-reference",
+            record.id,
+        )
+        # If there is no EMBL cross-reference, we can try the GeneID as
+        # a fallback. This refers to a gene database record at NCBI, which
+        # then must be queried to get the nucleotide cross-reference.
+        logger.debug("Trying xref_geneid as last resort")
+        gresult = u_service.search(query_acc, columns="xref_geneid")
+        gstring = gresult.split("\n")[1].strip()[:-1] if "\n" in gresult else ""
+
+        if gstring == "":
+            logger.warning(
+                "Uniprot record %s has no GeneID cross-reference (skipping)",
+                record.id,
+            )
+            return None
+
+        # Fetch the GeneID entry and extract nucleotide information from it.
+        logger.debug("Finding nucleotide entry from GeneID %s", gstring)
+        handle = ncbi_cds_from_protein.entrez.efetch_with_retries(
+            gstring,
+            "gene",
+            "acc",
+            "text",
+            10,
+        )  # NOTE: hard-coded retry count
+        acc = geneid_nt_accession(handle)
+        if acc is None:
+            logger.warning(
+                "No nucleotide entry found for %s (skipping)",
+                gstring,
+            )
+            return None
+        qstring = acc  # This is our new query string
+        logger.debug("Found nucleotide entry %s", qstring)
+        # We also need the xref_refseq entry to get a protein ID for
+        # the query.
+        logger.debug("Finding protein entry from GeneID %s", gstring)
+        presult = u_service.search(gstring, columns="xref_refseq")
+        pstring = presult.split("\n")[1].strip()[:-1]
+        if pstring == "":
+            logger.warning(
+                "Could not identify RefSeq protein ID for %s (skipping)",
+                gstring,
+            )
+            return None
+        logger.debug("Found RefSeq protein IDs %s", pstring)
+    return qstring, pstring
+
+
 # Process collection of SeqRecords into cache and skipped/kept
 def process_sequences(
     records: Iterable[SeqRecord],
@@ -125,6 +235,11 @@ def process_sequences(
     :param records:  collection of SeqRecords
     :param cachepath: path to local sequence cache
     :param disabletqdm:  turn off tqdm progress bar
+
+    Each UniProt record needs several queries of remote services to find
+    its NCBI query terms. These are made concurrently, in a thread pool,
+    and their results taken in input order; the cache is only read and
+    written in this thread.
     """
     logger = logging.getLogger(__name__)
     logger.info("Processing sequences...")
@@ -133,131 +248,94 @@ def process_sequences(
 
     u_service = UniProt()
 
-    for record in tqdm(
-        records,
-        desc="1/5 Process input sequences",
-        disable=disabletqdm,
-    ):
-        seqtype = guess_seqtype(record)
-        if seqtype == "UniParc":
-            logger.warning(
-                "Record %s looks like a UniParc cluster (skipping)",
-                record.id,
-            )
-            skipped.append(record)
-            continue
-        elif seqtype == "UniProt":
-            match = re.search(re_uniprot_gn, record.description)
-            pstring = None  # None if we don't need to look up GeneID
-            if match is None:  # No GN field
+    records = list(records)
+    seqtypes = [guess_seqtype(record) for record in records]
+
+    # Lookups are all submitted before the loop: if the loop fails, those not
+    # yet started are cancelled rather than waited for
+    executor = ThreadPoolExecutor(max_workers=UNIPROT_WORKERS)
+    try:
+        # One lookup per distinct UniProt accession, shared by all records with
+        # that accession (e.g. several domains of one protein), so that
+        # identical requests are never in flight at once
+        lookups = {}
+        for record, seqtype in zip(records, seqtypes, strict=True):
+            if (
+                seqtype == "UniProt"
+                and uniprot_accession(record) not in lookups
+                and re_uniprot_gn.search(record.description)
+            ):
+                lookups[uniprot_accession(record)] = executor.submit(
+                    uniprot_nt_query, record, u_service
+                )
+        for record, seqtype in tqdm(
+            zip(records, seqtypes, strict=True),
+            total=len(records),
+            desc="1/5 Process input sequences",
+            disable=disabletqdm,
+            mininterval=1.0,  # one iteration per record; redraw at most 1/s
+        ):
+            if seqtype == "UniParc":
                 logger.warning(
-                    "Uniprot record %s has no GN field (skipping)",
+                    "Record %s looks like a UniParc cluster (skipping)",
                     record.id,
                 )
                 skipped.append(record)
                 continue
-            logger.debug(
-                "Uniprot record %s has GN field: %s",
-                record.id,
-                match.group(0),
-            )
-            # The UniProt API was updated in June 2022, requiring a change
-            # to the returned field for the cross-reference to EMBL
-            # Get the UniProt ID from the accession and use this to query the API
-            query_acc = record.id.split("|")[1]
-            logger.debug(
-                "Querying UniProt with %s to match xref_embl",
-                query_acc,
-            )
-            # Use the UniProt record ID as the query to the EMBL ID, retrieving
-            # the EMBL record accession, and the ORF gene name
-            # bioservices 1.12 now returns a string without trailing \n if there is
-            # no match, so we need to account for this for each of qstring, pstring,
-            # and gstring
-            qstring, pstring = uniprot_to_embl(query_acc, u_service)
-            if qstring == "":
-                logger.warning(
-                    "Uniprot record %s has no EMBL cross-reference",
-                    record.id,
-                )
-                # If there is no EMBL cross-reference, we can try the GeneID as
-                # a fallback. This refers to a gene database record at NCBI, which
-                # then must be queried to get the nucleotide cross-reference.
-                logger.debug("Trying xref_geneid as last resort")
-                gresult = u_service.search(query_acc, columns="xref_geneid")
-                gstring = gresult.split("\n")[1].strip()[:-1] if "\n" in gresult else ""
-
-                if gstring == "":
+            elif seqtype == "UniProt":
+                match = re_uniprot_gn.search(record.description)
+                if match is None:  # No GN field
                     logger.warning(
-                        "Uniprot record %s has no GeneID cross-reference (skipping)",
+                        "Uniprot record %s has no GN field (skipping)",
                         record.id,
                     )
+                    skipped.append(record)
                     continue
-
-                # Fetch the GeneID entry and extract nucleotide information from it.
-                logger.debug("Finding nucleotide entry from GeneID %s", gstring)
-                handle = ncbi_cds_from_protein.entrez.efetch_with_retries(
-                    gstring,
-                    "gene",
-                    "acc",
-                    "text",
-                    10,
-                )  # NOTE: hard-coded retry count
-                acc = [
-                    _.strip().split()[1]
-                    for _ in handle.readlines()
-                    if _.strip().startswith("Annotation")
-                ]
-                if len(acc) == 0:
-                    logger.warning(
-                        "No nucleotide entry found for %s (skipping)",
-                        gstring,
-                    )
+                logger.debug(
+                    "Uniprot record %s has GN field: %s",
+                    record.id,
+                    match.group(0),
+                )
+                result = lookups[uniprot_accession(record)].result()
+                if result is None:
                     continue
-                qstring = acc[0]  # This is our new query string
-                logger.debug("Found nucleotide entry %s", qstring)
-                # We also need the xref_refseq entry to get a protein ID for
-                # the query.
-                logger.debug("Finding protein entry from GeneID %s", gstring)
-                presult = u_service.search(gstring, columns="xref_refseq")
-                pstring = presult.split("\n")[1].strip()[:-1]
-                if pstring == "":
-                    logger.warning(
-                        "Could not identify RefSeq protein ID for %s (skipping)",
-                        gstring,
+                qstring, pstring = result
+                logger.debug("Recovered NCBI database accession: %s", qstring)
+                logger.debug("Accession has ORF gene name: %s", pstring)
+                # UniProt can return multiple UIDs separated by semicolons. Sometimes the same
+                # UID is repeated. However, the current cache schema uses the accession as primary
+                # key in the same table as the query IDs.
+                # TODO(widdowquinn): Update schema to allow multiple queries per record
+                for qid in qstring.split(";"):
+                    logger.debug(
+                        "Adding record %s to cache with query %s", record.id, qid
                     )
-                    continue
-                logger.debug("Found RefSeq protein IDs %s", pstring)
-            logger.debug("Recovered NCBI database accession: %s", qstring)
-            logger.debug("Accession has ORF gene name: %s", pstring)
-            # UniProt can return multiple UIDs separated by semicolons. Sometimes the same
-            # UID is repeated. However, the current cache schema uses the accession as primary
-            # key in the same table as the query IDs.
-            # TODO(widdowquinn): Update schema to allow multiple queries per record
-            for qid in qstring.split(";"):
-                logger.debug("Adding record %s to cache with query %s", record.id, qid)
-                # Uniprot sequences are added to cache as (accession, NULL, nt_query)
+                    # Uniprot sequences are added to cache as (accession, NULL, nt_query)
+                    try:
+                        logger.debug(
+                            "Adding %s as nt ID (protein ID: %s)", qid, pstring
+                        )
+                        add_input_sequence(cachepath, record.id, pstring, qid)
+                    except sqlite3.IntegrityError:  # Sequence exists
+                        logger.warning(
+                            "Additional query terms found for %s: %s (not used)",
+                            record.id,
+                            qid,
+                        )
+                        continue
+            elif seqtype == "NCBI":
+                # NCBI sequences are added to cache as (accession, aa_query, NULL)
                 try:
-                    logger.debug("Adding %s as nt ID (protein ID: %s)", qid, pstring)
-                    add_input_sequence(cachepath, record.id, pstring, qid)
+                    add_input_sequence(cachepath, record.id, record.id, None)
                 except sqlite3.IntegrityError:  # Sequence exists
-                    logger.warning(
-                        "Additional query terms found for %s: %s (not used)",
-                        record.id,
-                        qid,
-                    )
                     continue
-        elif seqtype == "NCBI":
-            # NCBI sequences are added to cache as (accession, aa_query, NULL)
-            try:
-                add_input_sequence(cachepath, record.id, record.id, None)
-            except sqlite3.IntegrityError:  # Sequence exists
-                continue
-        # If the record has no query terms, skip it
-        if has_query(cachepath, record.id):
-            kept.append(record)
-        else:
-            skipped.append(record)
+            # If the record has no query terms, skip it
+            if has_query(cachepath, record.id):
+                kept.append(record)
+            else:
+                skipped.append(record)
+    finally:
+        executor.shutdown(cancel_futures=True)
 
     return kept, skipped
 
@@ -66,8 +66,8 @@ with Path("ncbi_cds_from_protein/__init__.py").open("r") as ifh:
             version = match.group("version")
             break
 
-if sys.version_info <= (3, 6):
-    sys.stderr.write("ERROR: ncfp requires Python 3.7 or above (exiting).\n")
+if sys.version_info < (3, 10):
+    sys.stderr.write("ERROR: ncfp requires Python 3.10 or above (exiting).\n")
     sys.exit(1)
 
 setuptools.setup(
@@ -92,8 +92,8 @@ setuptools.setup(
     packages=["ncbi_cds_from_protein", "ncbi_cds_from_protein.scripts"],
     package_data={},
     include_package_date=True,
-    install_requires=["biopython", "bioservices", "tqdm"],
-    python_requires="~=3.5",
+    install_requires=["biopython", "bioservices", "requests", "tqdm"],
+    python_requires=">=3.10",
     entry_points={
         "console_scripts": ["ncfp = ncbi_cds_from_protein.scripts.ncfp:run_main"]
     },
@@ -107,11 +107,9 @@ setuptools.setup(
         "Operating System :: POSIX :: Linux",
         "Programming Language :: Python",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.6",
-        "Programming Language :: Python :: 3.7",
-        "Programming Language :: Python :: 3.8",
-        "Programming Language :: Python :: 3.9",
         "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
+        "Programming Language :: Python :: 3.12",
         "Topic :: Scientific/Engineering :: Bio-Informatics",
     ],
 )
@@ -41,6 +41,7 @@ from pathlib import Path
 
 import pytest
 
+from ncbi_cds_from_protein import caches
 
 # Path to tests, contains tests and data subdirectories
 # This conftest.py file should be found in the top directory of the tests
@@ -175,3 +176,12 @@ def path_uniprot_stockholm_small_use_proteinid_targets():
 def path_single_cds_targets():
     """Path to targets for records with single CDS sequences."""
     yield TARGETPATH / "single_cds"
+
+
+@pytest.fixture
+def cachepath(tmp_path):
+    """Path to a freshly initialised, empty cache database."""
+    path = tmp_path / "ncfpcache_test.sqlite3"
+    caches.initialise_dbcache(path)
+    yield path
+    caches.close_cachedb(path)
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+# (c) The University of Strathclyde 2019-2024
+# Author: Leighton Pritchard
+#
+# Contact:
+# leighton.pritchard@strath.ac.uk
+#
+# Leighton Pritchard,
+# Strathclyde Institute of Pharmaceutical and Biomedical Sciences
+# The University of Strathclyde
+# 161 Cathedral Street
+# Glasgow
+# G4 0RE
+# Scotland,
+# UK
+#
+# The MIT License
+#
+# (c) The University of Strathclyde 2019-2024
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Test SQLite3 cache functions for the ncfp program."""
+
+import sqlite3
+
+import pytest
+
+from ncbi_cds_from_protein import caches
+
+
+def test_cachedb_reused(cachepath):
+    """Cache functions share a single connection per cache path."""
+    assert caches.get_cachedb(cachepath) is caches.get_cachedb(str(cachepath))
+
+
+def test_add_input_sequence(cachepath):
+    """Input sequences are added to the seqdata table with their queries."""
+    caches.add_input_sequence(cachepath, "prot1", "prot1", None)
+    caches.add_input_sequence(cachepath, "prot2", None, "nt2")
+
+    assert caches.has_query(cachepath, "prot1")
+    assert caches.has_aa_query(cachepath, "prot1")
+    assert not caches.has_nt_query(cachepath, "prot1")
+    assert caches.get_nt_query(cachepath, "prot2") == ("nt2",)
+
+
+def test_add_ncbi_uids(cachepath):
+    """Only UIDs new to the cache are reported as added."""
+    caches.add_input_sequence(cachepath, "prot1", "prot1", None)
+    caches.add_input_sequence(cachepath, "prot2", "prot2", None)
+
+    assert caches.add_ncbi_uids(cachepath, "prot1", ["1", "2", "2"]) == ["1", "2"]
+    assert caches.add_ncbi_uids(cachepath, "prot2", ["2", "3"]) == ["3"]
+    assert sorted(caches.get_nt_uids(cachepath)) == ["1", "2", "3"]
+    assert caches.has_ncbi_uid(cachepath, "prot2")
+
+
+def test_add_ncbi_uids_many(cachepath):
+    """UIDs for several records are added together, new UIDs listed once."""
+    for acc in ("prot1", "prot2", "prot3"):
+        caches.add_input_sequence(cachepath, acc, acc, None)
+    caches.add_ncbi_uids(cachepath, "prot1", ["1"])
+
+    links = [("prot2", ["1", "2"]), ("prot3", ["2", "3"])]
+    assert caches.add_ncbi_uids_many(cachepath, links) == ["2", "3"]
+    assert caches.get_accessions_with_ncbi_uids(
+        cachepath, ["prot1", "prot2", "prot3"]
+    ) == {"prot1", "prot2", "prot3"}
+
+
+def test_add_ncbi_uids_null(cachepath):
+    """A NULL UID is an error, not silently ignored like a repeated UID."""
+    caches.add_input_sequence(cachepath, "prot1", "prot1", None)
+
+    with pytest.raises(SystemExit):
+        caches.add_ncbi_uids(cachepath, "prot1", ["1", None])
+    assert caches.get_nt_uids(cachepath) == []
+
+
+def test_missing_genbank_queries(cachepath):
+    """UIDs/accessions lacking GenBank headers or records are identified."""
+    caches.add_input_sequence(cachepath, "prot1", "prot1", None)
+    caches.add_ncbi_uids(cachepath, "prot1", ["1", "2", "3"])
+    assert caches.update_nt_uid_acc(cachepath, "1", "NT1.1") == 1
+    assert caches.update_nt_uid_acc(cachepath, "2", "NT2.1") == 1
+    assert caches.update_nt_uid_acc(cachepath, "9", "NT9.1") == 0
+    assert caches.update_nt_uid_acc_many(cachepath, [("2", "NT2.1"), ("9", "")]) == 1
+    caches.add_gbheaders(cachepath, "NT1.1", 100, "org", "tax", "01-JAN-2020")
+    caches.add_gbfull(cachepath, "NT2.1", "LOCUS       NT2")
+
+    # UID 3 has no accession yet, so cannot be matched to GenBank data
+    assert caches.get_nogbhead_nt_uids(cachepath) == ["2"]
+    assert caches.get_nogbfull_nt_uids(cachepath) == ["1"]
+    assert caches.get_nogbfull_nt_acc(cachepath) == ["NT1.1"]
+
+
+def test_find_shortest_genbank(cachepath):
+    """The shortest GenBank record is chosen for each input sequence."""
+    for acc, uids in (("prot1", ["1", "2"]), ("prot2", ["2", "3", "4"])):
+        caches.add_input_sequence(cachepath, acc, acc, None)
+        caches.add_ncbi_uids(cachepath, acc, uids)
+    for uid, length in (("1", 500), ("2", 1000), ("3", 200), ("4", 200)):
+        caches.update_nt_uid_acc(cachepath, uid, f"NT{uid}.1")
+        caches.add_gbheaders(cachepath, f"NT{uid}.1", length, "org", "tax", "")
+
+    # NT3.1 and NT4.1 are equally short: the lowest accession is chosen
+    assert caches.find_shortest_genbank(cachepath) == {"NT1.1", "NT3.1"}
+    assert caches.get_gbheader_lengths(cachepath) == {
+        "prot1": [(500, "NT1.1"), (1000, "NT2.1")],
+        "prot2": [(200, "NT3.1"), (200, "NT4.1"), (1000, "NT2.1")],
+    }
+
+
+def test_cachedb_pragmas(cachepath):
+    """Cache connections use write-ahead logging."""
+    conn = caches.get_cachedb(cachepath).conn
+    assert conn.execute("PRAGMA journal_mode;").fetchone() == ("wal",)
+
+
+def test_get_accessions_with_ncbi_uids(cachepath):
+    """Bulk lookup returns only accessions having nt UIDs."""
+    for idx in range(1200):  # more accessions than fit in one query
+        caches.add_input_sequence(cachepath, f"prot{idx}", f"prot{idx}", None)
+    caches.add_ncbi_uids(cachepath, "prot1", ["1"])
+    caches.add_ncbi_uids(cachepath, "prot1100", ["2"])
+
+    accessions = [f"prot{idx}" for idx in range(1200)]
+    assert caches.get_accessions_with_ncbi_uids(cachepath, accessions) == {
+        "prot1",
+        "prot1100",
+    }
+
+
+def test_add_genbank_many(cachepath):
+    """GenBank headers and records are added in bulk."""
+    caches.add_input_sequence(cachepath, "prot1", "prot1", None)
+    caches.add_ncbi_uids(cachepath, "prot1", ["1", "2"])
+    caches.update_nt_uid_acc(cachepath, "1", "NT1.1")
+    caches.update_nt_uid_acc(cachepath, "2", "NT2.1")
+
+    headers = [("NT1.1", 10, "org", "tax", ""), ("NT2.1", 20, "org", "tax", "")]
+    assert caches.add_gbheaders_many(cachepath, headers) == 2
+    assert caches.add_gbfull_many(cachepath, [("NT1.1", "LOCUS       NT1")]) == 1
+    assert caches.get_nogbhead_nt_uids(cachepath) == []
+    assert caches.find_record_cds(cachepath, "prot1") == [
+        ("prot1", "NT1.1", "LOCUS       NT1")
+    ]
+    assert caches.find_records_cds(cachepath, ["prot1", "prot2"]) == {
+        "prot1": [("prot1", "NT1.1", "LOCUS       NT1")]
+    }
+
+
+def test_close_cachedb_checkpoints(cachepath):
+    """Closing the cache merges its write-ahead log into the database file."""
+    caches.add_input_sequence(cachepath, "prot1", "prot1", None)
+    caches.close_cachedb(cachepath)
+
+    assert not cachepath.with_name(cachepath.name + "-wal").exists()
+    assert caches.has_query(cachepath, "prot1")  # reopens the connection
+
+
+def test_cachedb_adds_indices(tmp_path):
+    """Opening a cache made without indices creates them."""
+    path = tmp_path / "ncfpcache_old.sqlite3"
+    with sqlite3.connect(str(path)) as conn:
+        conn.executescript(caches.SQL_CREATEDB)  # tables only, no indices
+    conn.close()
+
+    conn = caches.get_cachedb(path).conn
+    indices = {
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index';")
+    }
+    caches.close_cachedb(path)
+    assert {"idx_seq_nt_link_uid", "idx_seq_nt_link_nt_acc"} <= indices
+
+
+def test_cachedb_migrates_seq_nt(tmp_path):
+    """Opening a cache made by an older version of ncfp upgrades it."""
+    path = tmp_path / "ncfpcache_old.sqlite3"
+    with sqlite3.connect(str(path)) as conn:
+        conn.executescript("""
+            CREATE TABLE seqdata (accession TEXT PRIMARY KEY NOT NULL,
+                                  aa_query TEXT, nt_query TEXT);
+            CREATE TABLE seq_nt (seq_nt_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                 accession TEXT NOT NULL, uid TEXT NOT NULL);
+            CREATE TABLE nt_uid_acc (uid TEXT PRIMARY KEY NOT NULL,
+                                     accession TEXT);
+            CREATE TABLE gb_headers (accession TEXT PRIMARY KEY NOT NULL,
+                                     length INTEGER NOT NULL,
+                                     organism TEXT NOT NULL,
+                                     taxonomy TEXT NOT NULL,
+                                     date TEXT NOT NULL);
+            CREATE TABLE gb_full (accession TEXT PRIMARY KEY NOT NULL,
+                                  record TEXT NOT NULL);
+            INSERT INTO seqdata VALUES ('prot1', 'prot1', NULL);
+            INSERT INTO seq_nt (accession, uid) VALUES ('prot1', '1'), ('prot1', '2');
+            INSERT INTO nt_uid_acc VALUES ('1', 'NT1.1'), ('2', NULL);
+            INSERT INTO gb_full VALUES ('NT1.1', 'LOCUS       NT1');
+            """)
+    conn.close()
+
+    assert caches.get_nt_uids(path) == ["1", "2"]
+    assert caches.get_nt_noacc_uids(path) == ["2"]
+    assert caches.get_nogbhead_nt_uids(path) == ["1"]
+    assert caches.find_record_cds(path, "prot1") == [
+        ("prot1", "NT1.1", "LOCUS       NT1")
+    ]
+    conn = caches.get_cachedb(path).conn
+    assert not caches.get_cachedb(path).has_table("nt_uid_acc")
+    assert conn.execute("SELECT typeof(record) FROM gb_full;").fetchone() == ("blob",)
+    assert conn.execute("PRAGMA user_version;").fetchone() == (
+        caches.CACHE_SCHEMA_VERSION,
+    )
+    caches.close_cachedb(path)
+
+
+def test_add_ncbi_uids_known_accession(cachepath):
+    """A UID linked to another sequence keeps its known GenBank accession."""
+    caches.add_input_sequence(cachepath, "prot1", "prot1", None)
+    caches.add_input_sequence(cachepath, "prot2", "prot2", None)
+    caches.add_ncbi_uids(cachepath, "prot1", ["1"])
+    caches.update_nt_uid_acc(cachepath, "1", "NT1.1")
+
+    assert caches.add_ncbi_uids(cachepath, "prot2", ["1"]) == []
+    assert caches.get_nt_noacc_uids(cachepath) == []
+    assert caches.get_nogbhead_nt_uids(cachepath) == ["1"]
+
+
+def test_get_seqdata_queries(cachepath):
+    """Bulk lookup returns nt and aa queries for cached accessions."""
+    caches.add_input_sequence(cachepath, "prot1", "prot1", None)
+    caches.add_input_sequence(cachepath, "prot2", None, "nt2")
+
+    assert caches.get_seqdata_queries(cachepath, ["prot1", "prot2", "prot3"]) == {
+        "prot1": (None, "prot1"),
+        "prot2": ("nt2", None),
+    }
+
+
+def test_close_cachedb_optimizes(cachepath):
+    """Closing the cache gathers query planner statistics."""
+    for idx in range(100):
+        caches.add_input_sequence(cachepath, f"prot{idx}", f"prot{idx}", None)
+        caches.add_ncbi_uids(cachepath, f"prot{idx}", [str(idx), str(idx + 1)])
+    caches.get_accessions_with_ncbi_uids(cachepath, ["prot1"])  # uses index
+    caches.close_cachedb(cachepath)
+
+    with sqlite3.connect(str(cachepath)) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1;").fetchone()[0] > 0
+    conn.close()
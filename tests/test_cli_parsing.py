@@ -122,54 +122,50 @@ def mock_entrez_create_and_keep_cache(monkeypatch):
     in fixtures/sequences/human.fasta
     """
 
+    # The proteins are queried in a single batched ELink call, which returns
+    # one LinkSet per protein, in query order
+    linksets = (
+        (
+            b"<LinkSet>\n    <DbFrom>protein</DbFrom>\n    <IdList>\n      <Id>10835069</Id>\n    "
+            b"</IdList>\n    <LinkSetDb>\n      <DbTo>nuccore</DbTo>\n      "
+            b"<LinkName>protein_nuccore</LinkName>\n      \n        "
+            b"<Link>\n\t\t\t\t<Id>568815587</Id>\n\t\t\t</Link>\n        "
+            b"<Link>\n\t\t\t\t<Id>197116381</Id>\n\t\t\t</Link>\n      \n    </LinkSetDb>\n  "
+            b"</LinkSet>\n  "
+        ),
+        (
+            b"<LinkSet>\n    <DbFrom>protein</DbFrom>\n    <IdList>\n      <Id>283135214</Id>\n    "
+            b"</IdList>\n    <LinkSetDb>\n      <DbTo>nuccore</DbTo>\n      "
+            b"<LinkName>protein_nuccore</LinkName>\n      \n        "
+            b"<Link>\n\t\t\t\t<Id>1677498684</Id>\n\t\t\t</Link>\n        "
+            b"<Link>\n\t\t\t\t<Id>568815587</Id>\n\t\t\t</Link>\n      \n    </LinkSetDb>\n  "
+            b"</LinkSet>\n  "
+        ),
+        (
+            b"<LinkSet>\n    <DbFrom>protein</DbFrom>\n    <IdList>\n      <Id>530397002</Id>\n    "
+            b"</IdList>\n    <LinkSetDb>\n      <DbTo>nuccore</DbTo>\n      "
+            b"<LinkName>protein_nuccore</LinkName>\n      \n        "
+            b"<Link>\n\t\t\t\t<Id>767968522</Id>\n\t\t\t</Link>\n        "
+            b"<Link>\n\t\t\t\t<Id>568815587</Id>\n\t\t\t</Link>\n      \n    </LinkSetDb>\n  "
+            b"</LinkSet>\n  "
+        ),
+        (
+            b"<LinkSet>\n    <DbFrom>protein</DbFrom>\n    <IdList>\n      <Id>283135242</Id>\n    "
+            b"</IdList>\n    <LinkSetDb>\n      <DbTo>nuccore</DbTo>\n      "
+            b"<LinkName>protein_nuccore</LinkName>\n      \n        "
+            b"<Link>\n\t\t\t\t<Id>1677500256</Id>\n\t\t\t</Link>\n        "
+            b"<Link>\n\t\t\t\t<Id>568815587</Id>\n\t\t\t</Link>\n      \n    "
+            b"</LinkSetDb>\n  </LinkSet>\n"
+        ),
+    )
     responses = Mock()
     responses.side_effect = [
-        io.BytesIO(_)
-        for _ in (
-            (
-                b'<?xml version="1.0" encoding="UTF-8" ?>\n<!DOCTYPE eLinkResult '
-                b'PUBLIC "-//NLM//DTD elink 20101123//EN" '
-                b'"https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20101123/elink.dtd">\n<eLinkResult>\n\n  '
-                b"<LinkSet>\n    <DbFrom>protein</DbFrom>\n    <IdList>\n      <Id>10835069</Id>\n    "
-                b"</IdList>\n    <LinkSetDb>\n      <DbTo>nuccore</DbTo>\n      "
-                b"<LinkName>protein_nuccore</LinkName>\n      \n        "
-                b"<Link>\n\t\t\t\t<Id>568815587</Id>\n\t\t\t</Link>\n        "
-                b"<Link>\n\t\t\t\t<Id>197116381</Id>\n\t\t\t</Link>\n      \n    </LinkSetDb>\n  "
-                b"</LinkSet>\n</eLinkResult>\n"
-            ),
-            (
-                b'<?xml version="1.0" encoding="UTF-8" ?>\n<!DOCTYPE eLinkResult '
-                b'PUBLIC "-//NLM//DTD elink 20101123//EN" '
-                b'"https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20101123/elink.dtd">\n<eLinkResult>\n\n  '
-                b"<LinkSet>\n    <DbFrom>protein</DbFrom>\n    <IdList>\n      <Id>283135214</Id>\n    "
-                b"</IdList>\n    <LinkSetDb>\n      <DbTo>nuccore</DbTo>\n      "
-                b"<LinkName>protein_nuccore</LinkName>\n      \n        "
-                b"<Link>\n\t\t\t\t<Id>1677498684</Id>\n\t\t\t</Link>\n        "
-                b"<Link>\n\t\t\t\t<Id>568815587</Id>\n\t\t\t</Link>\n      \n    </LinkSetDb>\n  "
-                b"</LinkSet>\n</eLinkResult>\n"
-            ),
-            (
-                b'<?xml version="1.0" encoding="UTF-8" ?>\n<!DOCTYPE eLinkResult '
-                b'PUBLIC "-//NLM//DTD elink 20101123//EN" '
-                b'"https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20101123/elink.dtd">\n<eLinkResult>\n\n  '
-                b"<LinkSet>\n    <DbFrom>protein</DbFrom>\n    <IdList>\n      <Id>530397002</Id>\n    "
-                b"</IdList>\n    <LinkSetDb>\n      <DbTo>nuccore</DbTo>\n      "
-                b"<LinkName>protein_nuccore</LinkName>\n      \n        "
-                b"<Link>\n\t\t\t\t<Id>767968522</Id>\n\t\t\t</Link>\n        "
-                b"<Link>\n\t\t\t\t<Id>568815587</Id>\n\t\t\t</Link>\n      \n    </LinkSetDb>\n  "
-                b"</LinkSet>\n</eLinkResult>\n"
-            ),
-            (
-                b'<?xml version="1.0" encoding="UTF-8" ?>\n<!DOCTYPE eLinkResult '
-                b'PUBLIC "-//NLM//DTD elink 20101123//EN" '
-                b'"https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20101123/elink.dtd">\n<eLinkResult>\n\n  '
-                b"<LinkSet>\n    <DbFrom>protein</DbFrom>\n    <IdList>\n      <Id>283135242</Id>\n    "
-                b"</IdList>\n    <LinkSetDb>\n      <DbTo>nuccore</DbTo>\n      "
-                b"<LinkName>protein_nuccore</LinkName>\n      \n        "
-                b"<Link>\n\t\t\t\t<Id>1677500256</Id>\n\t\t\t</Link>\n        "
-                b"<Link>\n\t\t\t\t<Id>568815587</Id>\n\t\t\t</Link>\n      \n    "
-                b"</LinkSetDb>\n  </LinkSet>\n</eLinkResult>\n"
-            ),
+        io.BytesIO(
+            b'<?xml version="1.0" encoding="UTF-8" ?>\n<!DOCTYPE eLinkResult '
+            b'PUBLIC "-//NLM//DTD elink 20101123//EN" '
+            b'"https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20101123/elink.dtd">\n<eLinkResult>\n\n  '
+            + b"".join(linksets)
+            + b"</eLinkResult>\n"
         )
     ]
 
@@ -0,0 +1,678 @@
+# -*- coding: utf-8 -*-
+# (c) The University of Strathclyde 2019-2024
+# Author: Leighton Pritchard
+#
+# Contact:
+# leighton.pritchard@strath.ac.uk
+#
+# Leighton Pritchard,
+# Strathclyde Institute of Pharmaceutical and Biomedical Sciences
+# The University of Strathclyde
+# 161 Cathedral Street
+# Glasgow
+# G4 0RE
+# Scotland,
+# UK
+#
+# The MIT License
+#
+# (c) The University of Strathclyde 2019-2024
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Test Entrez query functions for the ncfp program."""
+
+import logging
+import subprocess
+import sys
+import time
+
+from http.client import HTTPMessage
+from io import BytesIO, StringIO, TextIOWrapper
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+
+from Bio import SeqIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+import pytest
+
+from ncbi_cds_from_protein import caches, entrez
+
+
+def test_rate_limiter():
+    """Calls through the rate limiter are evenly spaced."""
+    limiter = entrez.RateLimiter(0.02)
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.acquire()
+    assert time.monotonic() - start >= 5 * 0.02
+
+
+def test_rate_limiter_api_key(monkeypatch):
+    """Default spacing between calls depends on the NCBI API key."""
+    limiter = entrez.RateLimiter()
+    monkeypatch.setattr(entrez.Entrez, "api_key", None)
+    assert limiter.current_interval() == entrez.ENTREZ_INTERVAL
+    monkeypatch.setattr(entrez.Entrez, "api_key", "dummykey")
+    assert limiter.current_interval() == entrez.ENTREZ_INTERVAL_APIKEY
+
+
+LINKS = {"prot1": ["2", "3"], "prot2": ["3"]}  # nt UIDs linked to proteins
+
+
+def linkset(accession):
+    """Return ELink LinkSet for a protein accession, as parsed by Entrez."""
+    if accession not in LINKS:
+        return {"LinkSetDb": []}
+    return {"LinkSetDb": [{"Link": [{"Id": uid} for uid in LINKS[accession]]}]}
+
+
+@pytest.fixture
+def nt_id_records(cachepath):
+    """Records in the cache with protein or nucleotide queries."""
+    records = []
+    for seqid, aa_query, nt_query in (
+        ("prot1", "prot1", None),
+        ("prot2", "prot2", None),
+        ("prot3", "prot3", None),
+        ("prot4", None, "ntquery"),
+        ("prot5", None, "missing"),
+    ):
+        caches.add_input_sequence(cachepath, seqid, aa_query, nt_query)
+        records.append(type("Record", (), {"id": seqid}))
+    yield records
+
+
+def test_search_nt_ids(cachepath, nt_id_records, monkeypatch):
+    """Proteins are ELinked in batches, and results cached in query order."""
+    elink_queries = []
+
+    def fake_esearch(query_id, dbname, maxretries):
+        time.sleep(0.01 * (query_id == "ntquery"))  # finish out of order
+        return {"IdList": {"ntquery": ["1"]}.get(query_id, [])}
+
+    def fake_elink(query_id, dbname, linkdbname, maxretries):
+        elink_queries.append(query_id)
+        return [linkset(accession) for accession in query_id]
+
+    monkeypatch.setattr(entrez, "esearch_with_retries", fake_esearch)
+    monkeypatch.setattr(entrez, "elink_fetch_with_retries", fake_elink)
+
+    addedrows, noresult = entrez.search_nt_ids(nt_id_records, cachepath, 1, 2)
+    assert sorted(elink_queries) == [["prot1", "prot2"], ["prot3"]]
+    assert addedrows == ["1", "2", "3"]
+    assert noresult == 2
+
+
+def test_search_nt_ids_elink_fallback(cachepath, nt_id_records, monkeypatch):
+    """Proteins are ELinked singly if a batch's LinkSets can't be matched."""
+    elink_queries = []
+
+    def fake_elink(query_id, dbname, linkdbname, maxretries):
+        elink_queries.append(query_id)
+        return [linkset(query_id[0])]  # only ever one LinkSet
+
+    monkeypatch.setattr(entrez, "esearch_with_retries", lambda *args: {"IdList": []})
+    monkeypatch.setattr(entrez, "elink_fetch_with_retries", fake_elink)
+
+    addedrows, noresult = entrez.search_nt_ids(nt_id_records[:3], cachepath, 1)
+    assert elink_queries == [
+        ["prot1", "prot2", "prot3"],
+        ["prot1"],
+        ["prot2"],
+        ["prot3"],
+    ]
+    assert addedrows == ["2", "3"]
+    assert noresult == 1
+
+
+def test_search_nt_ids_shared_queries(cachepath, monkeypatch):
+    """Records sharing a protein accession are answered by one query."""
+    elink_queries = []
+    records = []
+    for seqid in ("prot1/1-50", "prot1/60-100", "prot2"):
+        caches.add_input_sequence(cachepath, seqid, seqid, None)
+        records.append(type("Record", (), {"id": seqid}))
+
+    def fake_elink(query_id, dbname, linkdbname, maxretries):
+        elink_queries.append(query_id)
+        return [linkset(accession) for accession in query_id]
+
+    monkeypatch.setattr(entrez, "elink_fetch_with_retries", fake_elink)
+
+    addedrows, noresult = entrez.search_nt_ids(records, cachepath, 1)
+    assert elink_queries == [["prot1", "prot2"]]
+    assert addedrows == ["2", "3"]
+    assert noresult == 0
+    assert caches.has_ncbi_uid(cachepath, "prot1/60-100")
+
+
+@pytest.fixture
+def entrez_session(monkeypatch):
+    """Route Bio.Entrez requests through SESSION for the test only."""
+    monkeypatch.setattr(entrez.Entrez, "urlopen", entrez.Entrez.urlopen)
+    monkeypatch.setattr(entrez.Entrez, "max_tries", entrez.Entrez.max_tries)
+    entrez.install_session()
+
+
+class FakeResponse:
+    """Minimal stand-in for a requests.Response from NCBI."""
+
+    def __init__(
+        self,
+        status_code=200,
+        content=b"NC_000913.3\n",
+        content_type="text/plain; charset=UTF-8",
+    ):
+        """Instantiate class."""
+        self.status_code = status_code
+        self.reason = "OK" if status_code < 400 else "Bad Request"
+        self.url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+        self.headers = {"Content-Type": content_type}
+        self.content = content
+
+
+def test_session_urlopen(email_address, entrez_session, monkeypatch):
+    """Entrez requests are made through the shared HTTP session."""
+    calls = []
+    monkeypatch.setattr(entrez.Entrez, "email", email_address)
+
+    def fake_request(method, url, **kwargs):
+        calls.append((method, url, kwargs))
+        return FakeResponse()
+
+    monkeypatch.setattr(entrez.SESSION, "request", fake_request)
+    handle = entrez.Entrez.efetch(
+        db="nucleotide", id="1", rettype="acc", retmode="text"
+    )
+    assert handle.read() == "NC_000913.3\n"
+    assert calls[0][0] == "GET" and "efetch.fcgi" in calls[0][1]
+    assert calls[0][2]["timeout"] == entrez.SESSION_TIMEOUT
+
+
+def test_session_retries_connections_only():
+    """The session adapter retries failed connections, not responses."""
+    retries = entrez.SESSION.get_adapter("https://eutils.ncbi.nlm.nih.gov").max_retries
+    assert retries.connect is None and retries.total == entrez.SESSION_CONNECT_RETRIES
+    assert retries.read is False and retries.status is False
+
+
+def test_session_urlopen_http_error(email_address, entrez_session, monkeypatch):
+    """HTTP errors from the session are raised as urllib HTTPErrors."""
+    monkeypatch.setattr(entrez.Entrez, "email", email_address)
+    monkeypatch.setattr(
+        entrez.SESSION, "request", lambda *args, **kwargs: FakeResponse(400)
+    )
+    with pytest.raises(HTTPError):
+        entrez.Entrez.efetch(db="nucleotide", id="1", rettype="acc", retmode="text")
+
+
+ESEARCH_XML = b"""<?xml version="1.0" encoding="UTF-8" ?>
+<!DOCTYPE eSearchResult PUBLIC "-//NLM//DTD esearch 20060628//EN" "https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20060628/esearch.dtd">
+<eSearchResult><Count>2</Count><RetMax>2</RetMax><RetStart>0</RetStart><IdList>
+<Id>568815587</Id>
+<Id>197116381</Id>
+</IdList><TranslationSet/><QueryTranslation>NC_000001[All Fields]</QueryTranslation></eSearchResult>
+"""
+
+ELINK_XML = b"""<?xml version="1.0" encoding="UTF-8" ?>
+<!DOCTYPE eLinkResult PUBLIC "-//NLM//DTD elink 20101123//EN" "https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20101123/elink.dtd">
+<eLinkResult>
+  <LinkSet>
+    <DbFrom>protein</DbFrom>
+    <IdList><Id>10835069</Id></IdList>
+    <LinkSetDb>
+      <DbTo>nuccore</DbTo>
+      <LinkName>protein_nuccore</LinkName>
+      <Link><Id>568815587</Id></Link>
+      <Link><Id>197116381</Id></Link>
+    </LinkSetDb>
+  </LinkSet>
+  <LinkSet>
+    <DbFrom>protein</DbFrom>
+    <IdList><Id>283135214</Id></IdList>
+  </LinkSet>
+</eLinkResult>
+"""
+
+
+def test_parse_esearch_idlist():
+    """ESearch UIDs are read as by Entrez.read()."""
+    assert (
+        entrez.parse_esearch_idlist(BytesIO(ESEARCH_XML))["IdList"]
+        == entrez.Entrez.read(BytesIO(ESEARCH_XML))["IdList"]
+    )
+
+
+def test_parse_elink_linksets():
+    """ELink LinkSets are read as by Entrez.read(), one per query ID."""
+    expected = [
+        {
+            "LinkSetDb": [
+                {"Link": [{"Id": link["Id"]} for link in linksetdb["Link"]]}
+                for linksetdb in linkset["LinkSetDb"]
+            ]
+        }
+        for linkset in entrez.Entrez.read(BytesIO(ELINK_XML))
+    ]
+    assert entrez.parse_elink_linksets(BytesIO(ELINK_XML)) == expected
+    assert [len(linkset["LinkSetDb"]) for linkset in expected] == [1, 0]
+
+
+def test_parse_elink_errors():
+    """Errors for the whole ELink query are raised, not for a single ID."""
+    with pytest.raises(entrez.NCFPELinkException):
+        entrez.parse_elink_linksets(
+            BytesIO(b"<eLinkResult><ERROR>Invalid db name</ERROR></eLinkResult>")
+        )
+    linksets = entrez.parse_elink_linksets(
+        BytesIO(
+            b"<eLinkResult><LinkSet><ERROR>Invalid uid</ERROR></LinkSet>"
+            b"</eLinkResult>"
+        )
+    )
+    assert linksets == [{"LinkSetDb": []}]
+
+
+def test_parse_gb_headers():
+    """GenBank header fields match those parsed by SeqIO."""
+    records = []
+    for idx, (organism, taxonomy) in enumerate(
+        (
+            ("Escherichia coli", ["Bacteria", "Pseudomonadota", "Enterobacterales"]),
+            (
+                "Homo sapiens " + "x" * 80,
+                ["Eukaryota"] + [f"Taxon{n}" for n in range(20)],
+            ),
+            ("unidentified", []),
+        )
+    ):
+        record = SeqRecord(
+            Seq("ACGT" * (idx + 10)),
+            id=f"NT{idx}.1",
+            name=f"NT{idx}",
+            description="test record",
+            annotations={
+                "molecule_type": "DNA",
+                "organism": organism,
+                "taxonomy": taxonomy,
+                "date": "01-JAN-2020",
+            },
+        )
+        records.append(record)
+    handle = StringIO()
+    SeqIO.write(records, handle, "gb")
+    # An organism name wrapped over two lines, as SeqIO does not write these
+    handle.write(
+        "LOCUS       NT9                       12 bp    DNA     linear   BCT 02-FEB-2021\n"
+        "DEFINITION  wrapped organism.\n"
+        "ACCESSION   NT9\n"
+        "VERSION     NT9.2\n"
+        "SOURCE      long name\n"
+        "  ORGANISM  Candidatus Longname\n"
+        "            bacterium strain X\n"
+        "            Bacteria; Candidatus Longname.\n"
+        "FEATURES             Location/Qualifiers\n"
+        "ORIGIN\n"
+        "        1 acgtacgtac gt\n"
+        "//\n"
+    )
+
+    handle.seek(0)
+    expected = [
+        (
+            record.id,
+            len(record),
+            record.annotations["organism"],
+            " ".join(record.annotations["taxonomy"]),
+            record.annotations["date"],
+        )
+        for record in SeqIO.parse(handle, "gb")
+    ]
+    handle.seek(0)
+    assert list(entrez.parse_gb_headers(handle)) == expected
+
+
+def test_parse_gb_headers_bad_locus(caplog):
+    """Records with a LOCUS line that can't be parsed are skipped."""
+    lines = [
+        "LOCUS       NT1          twelve bp    DNA     linear   BCT 01-JAN-2020\n",
+        "VERSION     NT1.1\n",
+        "  ORGANISM  Escherichia coli\n",
+        "            Bacteria.\n",
+        "//\n",
+        "LOCUS       NT2                       12 bp    DNA     linear   BCT 02-FEB-2021\n",
+        "VERSION     NT2.1\n",
+        "  ORGANISM  Escherichia coli\n",
+        "            Bacteria.\n",
+        "//\n",
+    ]
+    assert list(entrez.parse_gb_headers(lines)) == [
+        ("NT2.1", 12, "Escherichia coli", "Bacteria", "02-FEB-2021")
+    ]
+    assert "Could not parse GenBank LOCUS line" in caplog.text
+
+
+def test_split_gb_records():
+    """GenBank records are split verbatim, and keyed by their SeqIO IDs."""
+    records = [
+        SeqRecord(
+            Seq("ACGT" * (idx + 10)),
+            id=f"NT{idx}.{idx + 1}",
+            name=f"NT{idx}",
+            description="test record",
+            annotations={"molecule_type": "DNA"},
+        )
+        for idx in range(3)
+    ]
+    text = "".join(record.format("gb") + "\n" for record in records)
+
+    rows = list(entrez.split_gb_records(StringIO(text)))
+    assert [acc for acc, _ in rows] == [record.id for record in records]
+    assert [record for _, record in rows] == [record.format("gb") for record in records]
+
+
+def test_batched():
+    """IDs are split lazily into lists of at most the batch size."""
+    assert list(entrez.batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(entrez.batched([], 2)) == []
+
+
+def test_efetch_batches(monkeypatch):
+    """Batches are fetched concurrently, and results yielded in batch order."""
+
+    def fake_epost(qids, dbname, maxretries):
+        if qids == ["bad"]:
+            raise entrez.NCFPMaxretryException()
+        return {"WebEnv": "env", "QueryKey": ",".join(qids)}
+
+    def fake_efetch(history, dbname, rettype, retmode, maxretries):
+        time.sleep(0.01 * (history["QueryKey"] == "1,2"))  # finish out of order
+        return StringIO(history["QueryKey"])
+
+    monkeypatch.setattr(entrez, "epost_history_with_retries", fake_epost)
+    monkeypatch.setattr(entrez, "efetch_history_with_retries", fake_efetch)
+
+    results = entrez.efetch_batches(
+        [["1", "2"], ["bad"], ["3"]], "nucleotide", "gb", "text", 1
+    )
+    assert [None if data is None else data.read() for data in results] == [
+        "1,2",
+        None,
+        "3",
+    ]
+
+
+def test_efetch_batches_bounded(monkeypatch):
+    """Only a limited number of batches are downloaded ahead of the caller."""
+    posted = []
+
+    def fake_epost(qids, dbname, maxretries):
+        posted.append(qids)
+        return {"WebEnv": "env", "QueryKey": ",".join(qids)}
+
+    monkeypatch.setattr(entrez, "EFETCH_PENDING", 3)
+    monkeypatch.setattr(entrez, "epost_history_with_retries", fake_epost)
+    monkeypatch.setattr(
+        entrez,
+        "efetch_history_with_retries",
+        lambda history, *args: StringIO(history["QueryKey"]),
+    )
+
+    results = entrez.efetch_batches(
+        ([str(idx)] for idx in range(10)), "nucleotide", "gb", "text", 1
+    )
+    assert next(results).read() == "0"
+    assert len(posted) <= 4  # three ahead, and the batch just submitted
+    assert [data.read() for data in results] == [str(idx) for idx in range(1, 10)]
+
+
+def test_rate_limiter_backoff():
+    """Backing off holds the next call back by one interval."""
+    limiter = entrez.RateLimiter(0.05)
+    limiter.acquire()
+    time.sleep(0.05)  # the next call would be allowed immediately
+    limiter.backoff()
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.04
+
+
+def test_session_urlopen_ratelimit_header(email_address, entrez_session, monkeypatch):
+    """Responses near NCBI's rate limit make the limiter back off."""
+    backoffs = []
+    response = FakeResponse()
+    response.headers["X-RateLimit-Remaining"] = "1"
+    monkeypatch.setattr(entrez.Entrez, "email", email_address)
+    monkeypatch.setattr(entrez.SESSION, "request", lambda *args, **kwargs: response)
+    monkeypatch.setattr(entrez.RATE_LIMITER, "backoff", lambda: backoffs.append(1))
+
+    entrez.Entrez.efetch(db="nucleotide", id="1", rettype="acc", retmode="text")
+    assert backoffs == [1]
+
+
+def test_set_entrez_email(email_address, entrez_session, monkeypatch):
+    """Setting an NCBI API key shortens the rate limiter interval."""
+    monkeypatch.setattr(entrez.Entrez, "email", None)
+    monkeypatch.setattr(entrez.Entrez, "api_key", None)
+    entrez.set_entrez_email(email_address, "dummykey")
+    assert entrez.Entrez.api_key == "dummykey"
+    assert entrez.RATE_LIMITER.current_interval() == entrez.ENTREZ_INTERVAL_APIKEY
+
+
+@pytest.fixture
+def no_retry_delay(monkeypatch):
+    """Retry Entrez requests without waiting."""
+    monkeypatch.setattr(entrez, "backoff_delay", lambda tries: 0)
+    monkeypatch.setattr(entrez.RATE_LIMITER, "acquire", lambda: None)
+
+
+def test_esearch_retries_transient_errors(no_retry_delay, monkeypatch):
+    """Transient errors are retried, up to the maximum number of attempts."""
+    calls = []
+
+    def fake_esearch(**kwargs):
+        calls.append(kwargs)
+        raise URLError("connection reset")
+
+    monkeypatch.setattr(entrez.Entrez, "esearch", fake_esearch)
+    with pytest.raises(entrez.NCFPMaxretryException):
+        entrez.esearch_with_retries("query", "nucleotide", 3)
+    assert len(calls) == 3
+
+
+def test_retry_warnings_omit_traceback(no_retry_delay, caplog, monkeypatch):
+    """Failed queries warn in one line; the traceback is logged for debug."""
+
+    def fake_esearch(**kwargs):
+        raise URLError("connection reset")
+
+    monkeypatch.setattr(entrez.Entrez, "esearch", fake_esearch)
+    caplog.set_level(logging.DEBUG, logger=entrez.__name__)
+    with pytest.raises(entrez.NCFPMaxretryException):
+        entrez.esearch_with_retries("query", "nucleotide", 1)
+    levels = {record.levelname: record for record in caplog.records}
+    assert "connection reset" in levels["WARNING"].getMessage()
+    assert levels["WARNING"].exc_info is None
+    assert levels["DEBUG"].exc_info is not None
+
+
+def test_esearch_fails_fast_on_bad_request(no_retry_delay, monkeypatch):
+    """Errors that retrying cannot fix are not retried."""
+    calls = []
+
+    def fake_esearch(**kwargs):
+        calls.append(kwargs)
+        raise HTTPError("url", 400, "Bad Request", None, None)
+
+    monkeypatch.setattr(entrez.Entrez, "esearch", fake_esearch)
+    with pytest.raises(entrez.NCFPMaxretryException):
+        entrez.esearch_with_retries("query", "nucleotide", 3)
+    assert len(calls) == 1
+
+
+def test_retry_honours_retry_after(monkeypatch):
+    """A Retry-After header longer than our backoff sets the delay."""
+    sleeps = []
+    monkeypatch.setattr(entrez.time, "sleep", sleeps.append)
+    monkeypatch.setattr(entrez, "backoff_delay", lambda tries: 1.0)
+    headers = HTTPMessage()
+    headers["Retry-After"] = "5"
+    exc = HTTPError("url", 429, "Too Many Requests", headers, None)
+    entrez.retry_wait(exc, 1, 3, "failed")
+    entrez.retry_wait(URLError("connection reset"), 1, 3, "failed")
+    assert sleeps == [5.0, 1.0]
+
+
+def test_biopython_does_not_retry(entrez_session):
+    """Retries are left to call_with_retries, not repeated by Bio.Entrez."""
+    assert entrez.Entrez.max_tries == 1
+    assert entrez.Entrez.urlopen is entrez.session_urlopen
+
+
+def test_import_leaves_biopython_unchanged():
+    """Importing the module does not change Bio.Entrez for other code."""
+    code = (
+        "import urllib.request\n"
+        "from Bio import Entrez\n"
+        "max_tries = Entrez.max_tries\n"
+        "import ncbi_cds_from_protein.entrez\n"
+        "assert Entrez.urlopen is urllib.request.urlopen\n"
+        "assert Entrez.max_tries == max_tries\n"
+    )
+    subprocess.run(
+        [sys.executable, "-c", code], check=True, cwd=Path(__file__).parents[1]
+    )
+
+
+def test_backoff_delay():
+    """Retry delays grow exponentially, with jitter, up to a maximum."""
+    assert 1.0 <= entrez.backoff_delay(1) <= 1.5
+    assert 4.0 <= entrez.backoff_delay(3) <= 6.0
+    assert entrez.backoff_delay(20) == entrez.RETRY_MAX_DELAY
+
+
+def test_update_gb_accessions(cachepath, monkeypatch):
+    """Accessions are fetched in batches and matched to UIDs by summary ID."""
+    posted = []
+
+    def fake_epost(qids, dbname, maxretries):
+        posted.append(qids)
+        return {"WebEnv": "env", "QueryKey": qids}
+
+    def fake_esummary(history, dbname, maxretries):
+        # summaries out of UID order, and none for the withdrawn UID 3
+        return [
+            {"Id": uid, "AccessionVersion": f"NT{uid}.1"}
+            for uid in reversed(history["QueryKey"])
+            if uid != "3"
+        ]
+
+    monkeypatch.setattr(entrez, "epost_history_with_retries", fake_epost)
+    monkeypatch.setattr(entrez, "esummary_history_with_retries", fake_esummary)
+    caches.add_input_sequence(cachepath, "prot1", "prot1", None)
+    caches.add_ncbi_uids(cachepath, "prot1", ["1", "2", "3"])
+
+    updated, noupdate = entrez.update_gb_accessions(cachepath, 1, 2)
+    assert sorted(posted) == [["1", "2"], ["3"]]  # posted concurrently
+    assert updated == ["1", "2"]
+    assert noupdate == 1
+    assert caches.get_nt_noacc_uids(cachepath) == ["3"]
+    assert caches.get_nogbhead_nt_uids(cachepath) == ["1", "2"]
+
+
+def test_efetch_history_returns_rewound_handle(no_retry_delay, monkeypatch):
+    """GenBank EFetch handles are checked, then returned from the start."""
+    responses = [
+        b"LOCUS       X\n//\n",
+        b"Service unavailable\n",
+        b"<html>Service unavailable</html>\n",
+    ]
+
+    def fake_efetch(**kwargs):
+        content = responses.pop()
+        if content.startswith(b"<html>"):  # Bio.Entrez returns HTML as bytes
+            handle = BytesIO(content)
+            handle.headers = HTTPMessage()
+            handle.headers["Content-Type"] = "text/html"
+            return handle
+        return TextIOWrapper(BytesIO(content), encoding="UTF-8")
+
+    monkeypatch.setattr(entrez.Entrez, "efetch", fake_efetch)
+    handle = entrez.efetch_history_with_retries(
+        {"WebEnv": "env", "QueryKey": "1"}, "nucleotide", "gb", "text", 3
+    )
+    assert handle.read() == "LOCUS       X\n//\n"
+    assert not responses
+
+
+HTML_PAGE = b"<html><body>Service temporarily unavailable</body></html>\n"
+
+ESUMMARY_XML = b"""<?xml version="1.0" encoding="UTF-8" ?>
+<!DOCTYPE eSummaryResult PUBLIC "-//NLM//DTD esummary v1 20041029//EN" "https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20041029/esummary-v1.dtd">
+<eSummaryResult><DocSum><Id>556503834</Id>
+<Item Name="AccessionVersion" Type="String">NC_000913.3</Item>
+</DocSum></eSummaryResult>
+"""
+
+ESUMMARY_ERROR_XML = b"""<?xml version="1.0" encoding="UTF-8" ?>
+<!DOCTYPE eSummaryResult PUBLIC "-//NLM//DTD esummary v1 20041029//EN" "https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20041029/esummary-v1.dtd">
+<eSummaryResult><ERROR>Unable to obtain query #1</ERROR></eSummaryResult>
+"""
+
+
+def test_efetch_retries_html_response(
+    email_address, entrez_session, no_retry_delay, monkeypatch
+):
+    """An HTML page in place of GenBank records is retried, not fatal."""
+    calls = []
+    monkeypatch.setattr(entrez.Entrez, "email", email_address)
+
+    def fake_request(method, url, **kwargs):
+        calls.append(url)
+        return FakeResponse(content=HTML_PAGE, content_type="text/html")
+
+    monkeypatch.setattr(entrez.SESSION, "request", fake_request)
+    with pytest.raises(entrez.NCFPMaxretryException):
+        entrez.efetch_with_retries("1", "nucleotide", "gb", "text", 2)
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize(
+    "content,content_type",
+    [(HTML_PAGE, "text/html"), (ESUMMARY_ERROR_XML, "text/xml")],
+)
+def test_esummary_retries_bad_responses(
+    email_address, entrez_session, no_retry_delay, monkeypatch, content, content_type
+):
+    """HTML pages and NCBI ERROR responses to ESummary are retried."""
+    responses = [
+        FakeResponse(content=ESUMMARY_XML, content_type="text/xml"),
+        FakeResponse(content=content, content_type=content_type),
+    ]
+    monkeypatch.setattr(entrez.Entrez, "email", email_address)
+    monkeypatch.setattr(
+        entrez.SESSION, "request", lambda *args, **kwargs: responses.pop()
+    )
+    summaries = entrez.esummary_history_with_retries(
+        {"WebEnv": "env", "QueryKey": "1"}, "nucleotide", 2
+    )
+    assert summaries[0]["AccessionVersion"] == "NC_000913.3"
+    assert not responses
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# (c) The University of Strathclyde 2019-2024
+# Author: Leighton Pritchard
+#
+# Contact:
+# leighton.pritchard@strath.ac.uk
+#
+# Leighton Pritchard,
+# Strathclyde Institute of Pharmaceutical and Biomedical Sciences
+# The University of Strathclyde
+# 161 Cathedral Street
+# Glasgow
+# G4 0RE
+# Scotland,
+# UK
+#
+# The MIT License
+#
+# (c) The University of Strathclyde 2019-2024
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Test logging configuration for the ncfp program."""
+
+import logging
+
+from argparse import Namespace
+
+import pytest
+
+from ncbi_cds_from_protein.logger import NoColorFormatter, config_logger
+
+
+@pytest.fixture
+def package_logger():
+    """Package logger, with its configuration restored after the test."""
+    logger = logging.getLogger("ncbi_cds_from_protein")
+    level, handlers = logger.level, logger.handlers
+    logger.handlers = []
+    yield logger
+    for handler in logger.handlers:
+        handler.close()
+    logger.handlers = handlers
+    logger.setLevel(level)
+
+
+def test_nocolor_formatter():
+    """Messages are formatted with terminal colour escapes removed."""
+    record = logging.LogRecord(
+        "ncfp", logging.INFO, __file__, 1, "\x1b[1;32m%s\x1b[0m done", ("step",), None
+    )
+    assert NoColorFormatter().format(record) == "[INFO] [ncfp]: step done"
+
+
+def test_nocolor_formatter_no_args():
+    """Messages without arguments are not %-formatted."""
+    record = logging.LogRecord(
+        "ncfp", logging.INFO, __file__, 1, "100% complete", None, None
+    )
+    assert NoColorFormatter().format(record) == "[INFO] [ncfp]: 100% complete"
+
+
+def test_config_logger_level(package_logger, tmp_path):
+    """The logger level is the lowest level any handler will emit."""
+    args = Namespace(debug=False, verbose=False, logfile=None)
+    config_logger(args)
+    assert not package_logger.isEnabledFor(logging.INFO)
+
+    args = Namespace(debug=False, verbose=False, logfile=tmp_path / "ncfp.log")
+    config_logger(args)
+    assert package_logger.isEnabledFor(logging.INFO)
+    assert not package_logger.isEnabledFor(logging.DEBUG)
+
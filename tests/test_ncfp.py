@@ -121,6 +121,7 @@ def namespace_base(email_address, path_ncbi, tmp_path):
         cachedir=tmp_path / ".ncfp_cache",
         cachestem=time.strftime("%Y-%m-%d-%H-%m-%S"),
         batchsize=100,
+        api_key=None,
         retries=10,
         limit=None,
         filestem="ncfp",
@@ -413,3 +414,30 @@ def test_single_cds(
         path_single_cds_targets,
         ("ncfp_aa.fasta", "ncfp_nt.fasta"),
     )
+
+
+GB_RECORD = """LOCUS       AB000001                  12 bp    DNA     linear   BCT 01-JAN-2000
+DEFINITION  test.
+ACCESSION   AB000001
+VERSION     AB000001.1
+FEATURES             Location/Qualifiers
+     CDS             1..12
+                     /protein_id="X1.1"
+ORIGIN
+        1 atgaaaaaat ga
+//
+"""
+
+
+def test_read_gbrecord(monkeypatch):
+    """Parsed GenBank records are reused, and only a few are kept."""
+    monkeypatch.setattr(ncfp, "GBRECORD_CACHE_SIZE", 2)
+    gbrecords = {}
+
+    gbrecord = ncfp.read_gbrecord(gbrecords, "AB000001.1", GB_RECORD)
+    assert gbrecord.id == "AB000001.1"
+    assert ncfp.read_gbrecord(gbrecords, "AB000001.1", GB_RECORD) is gbrecord
+
+    ncfp.read_gbrecord(gbrecords, "AB000002.1", GB_RECORD)
+    ncfp.read_gbrecord(gbrecords, "AB000003.1", GB_RECORD)
+    assert list(gbrecords) == ["AB000002.1", "AB000003.1"]
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+# (c) The University of Strathclyde 2019-2024
+# Author: Leighton Pritchard
+#
+# Contact:
+# leighton.pritchard@strath.ac.uk
+#
+# Leighton Pritchard,
+# Strathclyde Institute of Pharmaceutical and Biomedical Sciences
+# The University of Strathclyde
+# 161 Cathedral Street
+# Glasgow
+# G4 0RE
+# Scotland,
+# UK
+#
+# The MIT License
+#
+# (c) The University of Strathclyde 2019-2024
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Test sequence handling functions for the ncfp program."""
+
+import sqlite3
+import time
+
+from io import StringIO
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+import pytest
+
+from ncbi_cds_from_protein import caches, sequences
+from ncbi_cds_from_protein.sequences import geneid_nt_accession
+
+
+def test_geneid_nt_accession():
+    """The accession is taken from the first Annotation line."""
+    record = StringIO(
+        "1. ompA\n"
+        "\n"
+        "Official Symbol: ompA\n"
+        "Annotation:  NC_000913.3 (1019013..1020053, complement)\n"
+        "Annotation:  NC_999999.1 (1..100)\n"
+    )
+    assert geneid_nt_accession(record) == "NC_000913.3"
+
+
+def test_geneid_nt_accession_missing():
+    """No accession is returned for a record lacking an Annotation line."""
+    record = StringIO("1. ompA\n\nOfficial Symbol: ompA\n\n")
+    assert geneid_nt_accession(record) is None
+
+
+def test_guess_seqtype():
+    """Sequence origin is guessed from the record header."""
+    for seqid, desc, seqtype in (
+        ("sp|P00001|A_HUMAN", "protein A OS=Homo sapiens GN=geneA", "UniProt"),
+        ("UPI0000000001", "UniParc cluster", "UniParc"),
+        ("WP_000000001.1", "NCBI protein | one pipe", "NCBI"),
+    ):
+        record = SeqRecord(Seq("M"), id=seqid, description=f"{seqid} {desc}")
+        assert sequences.guess_seqtype(record) == seqtype
+
+
+class FakeUniProt:
+    """Stand-in for the bioservices UniProt service."""
+
+    XREFS = {"P00001": "EMBL1;", "P00002": "EMBL2;EMBL3;", "P00003": ""}
+
+    def search(self, query, columns):
+        """Return UniProt search result table for an accession."""
+        time.sleep(0.01 * (query == "P00001"))  # finish out of order
+        if columns == "gene_orf":
+            return f"ORF\n{query}orf\n"
+        if columns == "xref_embl" and self.XREFS[query]:
+            return f"EMBL\n{self.XREFS[query]}\n"
+        return "EMBL"  # no match
+
+
+def test_process_sequences(cachepath, monkeypatch):
+    """UniProt lookups run concurrently; records are triaged in input order."""
+    monkeypatch.setattr(sequences, "UniProt", FakeUniProt)
+    records = [
+        SeqRecord(Seq("M"), id=seqid, description=f"{seqid} {desc}")
+        for seqid, desc in (
+            ("sp|P00001|A_HUMAN", "protein A GN=geneA"),
+            ("UPI0000000001", "UniParc cluster"),
+            ("sp|P00002|B_HUMAN", "protein B GN=geneB"),
+            ("sp|P00004|D_HUMAN", "protein D"),
+            ("sp|P00003|C_HUMAN", "protein C GN=geneC"),
+            ("WP_000000001.1", "NCBI protein"),
+        )
+    ]
+
+    kept, skipped = sequences.process_sequences(records, cachepath)
+    assert [record.id for record in kept] == [
+        "sp|P00001|A_HUMAN",
+        "sp|P00002|B_HUMAN",
+        "WP_000000001.1",
+    ]
+    assert [record.id for record in skipped] == [
+        "UPI0000000001",
+        "sp|P00004|D_HUMAN",
+    ]
+    assert caches.get_seqdata_queries(cachepath, ["sp|P00002|B_HUMAN"]) == {
+        "sp|P00002|B_HUMAN": ("EMBL2", "P00002orf")
+    }
+
+
+def test_process_sequences_repeated_ids(cachepath, monkeypatch):
+    """Records sharing a UniProt accession are looked up once."""
+    queries = []
+
+    class CountingUniProt(FakeUniProt):
+        def search(self, query, columns):
+            queries.append((query, columns))
+            return super().search(query, columns)
+
+    monkeypatch.setattr(sequences, "UniProt", CountingUniProt)
+    record = SeqRecord(
+        Seq("M"), id="sp|P00001|A_HUMAN", description="sp|P00001|A_HUMAN GN=geneA"
+    )
+
+    domain = SeqRecord(
+        Seq("M"),
+        id="sp|P00001|A_HUMAN/1-10",
+        description="sp|P00001|A_HUMAN/1-10 GN=geneA",
+    )
+
+    kept, skipped = sequences.process_sequences([record, record, domain], cachepath)
+    assert len(kept) == 3 and not skipped
+    assert sorted(queries) == [("P00001", "gene_orf"), ("P00001", "xref_embl")]
+
+
+def test_process_sequences_cancels_lookups(cachepath, monkeypatch):
+    """Pending UniProt lookups are cancelled if processing fails."""
+    started = []
+
+    class SlowUniProt(FakeUniProt):
+        XREFS = {f"P{idx:05d}": "EMBL1;" for idx in range(20)}
+
+        def search(self, query, columns):
+            started.append(query)
+            time.sleep(0.05)
+            return super().search(query, columns)
+
+    def fail_add(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(sequences, "UniProt", SlowUniProt)
+    monkeypatch.setattr(sequences, "add_input_sequence", fail_add)
+    records = [
+        SeqRecord(
+            Seq("M"),
+            id=f"sp|{acc}|X_HUMAN",
+            description=f"sp|{acc}|X_HUMAN protein X GN=gene{acc}",
+        )
+        for acc in SlowUniProt.XREFS
+    ]
+
+    with pytest.raises(sqlite3.OperationalError):
+        sequences.process_sequences(records, cachepath)
+    assert len(set(started)) < len(records)